@@ -4,11 +4,10 @@ from datetime import datetime
 from numpy import arange, array, add, float16, random, outer, dot, zeros, real, transpose, diag, argsort, sqrt, inner
 from scipy.linalg import sqrtm, inv, orth, eig
 from scipy.io import savemat
-from thunder.utils import load
-from thunder.timeseries import Stats, Fourier, CrossCorr
-from thunder.regression import RegressionModel
-from thunder.factorization import SVD
-from thunder.clustering import KMeans
+from thunder.regression.regress import RegressionModel
+from thunder.factorization.svd import SVD
+from thunder.clustering.kmeans import KMeans
+from thunder.rdds.timeseries import TimeSeries
 
 
 class ThunderDataTest(object):
@@ -32,6 +31,7 @@ class ThunderDataTest(object):
         self.rdd = rdd
 
     def loadinputdata(self, datafile, savefile=None):
+        from thunder.utils import load
         rdd = load(self.sc, datafile, preprocessmethod="dff-percentile")
         self.rdd = rdd
         self.datafile = datafile
@@ -62,6 +62,7 @@ class StatsTest(ThunderDataTest):
 
     def __init__(self, sc):
         ThunderDataTest.__init__(self, sc)
+        from thunder.timeseries import Stats
         self.method = Stats("std")
 
     def runtest(self):
@@ -107,6 +108,7 @@ class CrossCorrTest(ThunderDataTest):
         ThunderDataTest.__init__(self, sc)
 
     def runtest(self):
+        from thunder.timeseries import CrossCorr
         method = CrossCorr(sigfile=os.path.join(self.modelfile, "crosscorr"), lag=0)
         betas = method.calc(self.rdd)
         betas.count()
@@ -116,6 +118,7 @@ class FourierTest(ThunderDataTest):
 
     def __init__(self, sc):
         ThunderDataTest.__init__(self, sc)
+        from thunder.timeseries import Fourier
         self.method = Fourier(freq=5)
 
     def runtest(self):
@@ -184,6 +187,54 @@ class PCADirectTest(ThunderDataTest):
         svd = SVD(3, method="direct").calc(self.rdd)
 
 
+class PCARandomizedTest(ThunderDataTest):
+
+    def __init__(self, sc):
+        ThunderDataTest.__init__(self, sc)
+
+    def runtest(self):
+        svd = SVD(3, method="randomized", seed=0).calc(self.rdd)
+
+
+class SVDDirectTest(ThunderDataTest):
+    """
+    SVD of an ill-conditioned synthetic matrix, with column scales decaying geometrically from 1 to 1e-12,
+    so that its singular values are close to sqrt(numrecords) times the scales.
+
+    The relative errors of the singular values from the last run are kept in self.errors, for comparing
+    the accuracy of the gramian-based method with SVDTsqrTest.
+    """
+    method = "direct"
+
+    def __init__(self, sc):
+        ThunderDataTest.__init__(self, sc)
+
+    def createinputdata(self, numrecords, numdims, numpartitions):
+        from thunder.rdds.matrices import RowMatrix
+        numdims = int(numdims)
+        self.scales = 10.0 ** -(12.0 * arange(numdims) / max(numdims - 1, 1))
+        random.seed(0)
+        rotation = orth(random.randn(numdims, numdims))
+        scales = self.scales
+
+        def randrow(seed):
+            rs = random.RandomState(seed)
+            return dot(rs.randn(numdims) * scales, rotation.T)
+        self.rdd = RowMatrix(self.sc.parallelize(arange(0, numrecords), numpartitions).map(lambda i: (i, randrow(i))))
+        self.numrecords = numrecords
+
+    def runtest(self):
+        svd = SVD(len(self.scales), method=self.method).calc(self.rdd)
+        self.errors = abs(svd.s / (sqrt(self.numrecords) * self.scales) - 1)
+
+
+class SVDTsqrTest(SVDDirectTest):
+    """
+    SVD of an ill-conditioned synthetic matrix computed from the R factor of a TSQR decomposition.
+    """
+    method = "tsqr"
+
+
 class PCAIterativeTest(ThunderDataTest):
 
     def __init__(self, sc):
@@ -214,17 +265,69 @@ class PCAIterativeTest(ThunderDataTest):
             iter += 1
 
 
+class SeriesPerRecordTest(ThunderDataTest):
+    """
+    Chain of common TimeSeries methods, applied one record at a time.
+
+    Compare against SeriesVectorizedTest to measure the speedup from partition-blocked execution.
+    """
+    vectorized = False
+
+    def __init__(self, sc):
+        ThunderDataTest.__init__(self, sc)
+
+    def runtest(self):
+        data = TimeSeries(self.rdd).vectorize(self.vectorized)
+        data.detrend().normalize('mean').zscore().seriesStats().count()
+
+
+class SeriesVectorizedTest(SeriesPerRecordTest):
+    """
+    Chain of common TimeSeries methods, applied to each partition stacked into a single array.
+    """
+    vectorized = True
+
+
+class DeconvolveTest(ThunderDataTest):
+    """
+    AR(1) spike deconvolution of synthetic calcium traces, with the decay estimated for each trace.
+
+    Traces have Poisson spikes of random amplitude, decay by a random factor per time point, and white noise.
+    """
+    def __init__(self, sc):
+        ThunderDataTest.__init__(self, sc)
+
+    def createinputdata(self, numrecords, numdims, numpartitions):
+        def synthtrace(seed):
+            from scipy.signal import lfilter
+            rs = random.RandomState(seed)
+            spikes = (rs.rand(int(numdims)) < 0.02) * (1 + rs.rand(int(numdims)))
+            g = rs.uniform(0.8, 0.98)
+            return lfilter([1.0], [1.0, -g], spikes) + 0.2 * rs.randn(int(numdims))
+        rdd = self.sc.parallelize(arange(0, numrecords), numpartitions).map(lambda i: (i, synthtrace(i)))
+        self.rdd = rdd
+
+    def runtest(self):
+        TimeSeries(self.rdd).deconvolve(penalty=0.1).count()
+
+
 TESTS = {
     'stats': StatsTest,
     'average': AverageTest,
     'regress': RegressTest,
     'regresswithsave': RegressWithSaveTest,
-    'crosscorr': CrossCorr,
-    'fourier': Fourier,
+    'crosscorr': CrossCorrTest,
+    'fourier': FourierTest,
     'load': LoadTest,
     'save': SaveTest,
     'ica': ICATest,
     'pca-direct': PCADirectTest,
     'pca-iterative': PCAIterativeTest,
-    'kmeans': KMeansTest
+    'pca-randomized': PCARandomizedTest,
+    'kmeans': KMeansTest,
+    'series-perrecord': SeriesPerRecordTest,
+    'series-vectorized': SeriesVectorizedTest,
+    'deconvolve': DeconvolveTest,
+    'svd-direct': SVDDirectTest,
+    'svd-tsqr': SVDTsqrTest
 }
@@ -0,0 +1,72 @@
+from numpy import array, allclose, array_equal, vstack
+from nose.tools import assert_equals, assert_true
+
+from thunder.rdds.blockedseries import BlockedSeries
+from thunder.rdds.series import Series
+from test_utils import PySparkTestCase, elementwiseMean, elementwiseVar
+
+
+class TestBlockedSeries(PySparkTestCase):
+    def setUp(self):
+        super(TestBlockedSeries, self).setUp()
+        self.dataLocal = [
+            ((0, 0), array([1.0, 2.0, 3.0])),
+            ((0, 1), array([2.0, 2.0, 4.0])),
+            ((1, 0), array([4.0, 2.0, 1.0])),
+            ((1, 1), array([3.0, 1.0, 1.0])),
+            ((2, 0), array([5.0, 0.0, 2.0]))
+        ]
+        self.series = Series(self.sc.parallelize(self.dataLocal, 2))
+
+    def test_fromSeries(self):
+        blocked = BlockedSeries.fromSeries(self.series)
+        chunks = blocked.rdd.collect()
+        assert_equals(2, len(chunks))
+        keys = vstack([k for k, _ in chunks])
+        values = vstack([v for _, v in chunks])
+        assert_true(array_equal(array([k for k, _ in self.dataLocal]), keys))
+        assert_true(array_equal(array([v for _, v in self.dataLocal]), values))
+        assert_equals(5, blocked.nrecords)
+        assert_true(array_equal(array([0, 1, 2]), blocked.index))
+
+    def test_chunkSize(self):
+        blocked = self.series.toBlockedSeries(chunkSize=2)
+        assert_equals([2, 2, 1], [k.shape[0] for k, _ in blocked.rdd.collect()])
+        assert_equals(5, blocked.count())
+
+    def test_roundtrip(self):
+        roundtripped = BlockedSeries.fromSeries(self.series, chunkSize=2).toSeries().collect()
+        for (expectedKey, expectedVal), (actualKey, actualVal) in zip(self.dataLocal, roundtripped):
+            assert_equals(expectedKey, actualKey)
+            assert_true(array_equal(expectedVal, actualVal))
+
+    def test_dims(self):
+        blocked = BlockedSeries.fromSeries(self.series)
+        assert_equals((3, 2), blocked.dims.count)
+
+    def test_stats(self):
+        blocked = BlockedSeries.fromSeries(self.series)
+        arys = [v for _, v in self.dataLocal]
+        stats = blocked.stats()
+        assert_true(allclose(elementwiseMean(arys), blocked.mean()))
+        assert_true(allclose(elementwiseMean(arys), stats.mean()))
+        assert_true(allclose(elementwiseVar(arys), stats.variance()))
+        assert_true(allclose(array([15.0, 7.0, 11.0]), blocked.sum()))
+        assert_true(array_equal(array([5.0, 2.0, 4.0]), blocked.max()))
+        assert_true(array_equal(array([1.0, 0.0, 1.0]), blocked.min()))
+
+    def test_filter(self):
+        blocked = BlockedSeries.fromSeries(self.series)
+        filtered = blocked.filterOnKeys(lambda k: k[0] > 0)
+        assert_equals(3, filtered.count())
+        assert_equals([(1, 0), (1, 1), (2, 0)], filtered.toSeries().keys().collect())
+        filtered = blocked.filterOnValues(lambda v: v[0] > 4)
+        assert_equals(1, filtered.count())
+
+    def test_applyValues(self):
+        blocked = BlockedSeries.fromSeries(self.series)
+        byRecord = blocked.applyValues(lambda v: v.sum()).collectValuesAsArray()
+        byChunk = blocked.applyValues(None, batchFunc=lambda v: v.sum(axis=1)).collectValuesAsArray()
+        expected = array([[v.sum()] for _, v in self.dataLocal])
+        assert_true(allclose(expected, byRecord))
+        assert_true(allclose(expected, byChunk))
@@ -371,4 +371,21 @@ class TestDataMethods(PySparkTestCase):
 
         print(out)
 
-        assert(array_equal(out, [[0], [3], [1], [4], [2], [5]]))
\ No newline at end of file
+        assert(array_equal(out, [[0], [3], [1], [4], [2], [5]]))
+
+    def test_quantiles(self):
+        from numpy import percentile
+        from numpy.random import RandomState
+        arys = RandomState(0).randn(2000, 2, 2)
+        data = Data(self.sc.parallelize(zip(range(2000), arys), 4))
+        # small enough to be summarized exactly
+        out = data.quantiles([0.0, 0.5, 1.0], k=4096)
+        assert_equals((3, 2, 2), out.shape)
+        assert_true(array_equal(arys.min(axis=0), out[0]))
+        assert_true(array_equal(arys.max(axis=0), out[2]))
+        assert_true(allclose(percentile(arys, 50, axis=0), out[1], atol=1e-3))
+        # approximate, the rank of each estimate is close to the one requested
+        out = data.quantiles(0.25, k=64)
+        assert_true(allclose((arys < out).mean(axis=0), 0.25, atol=0.03))
+        out = data.quantiles(0.9, axis=None)
+        assert_true(allclose((arys < out).mean(), 0.9, atol=0.01))
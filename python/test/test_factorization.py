@@ -4,6 +4,7 @@ from numpy import array, allclose, transpose, random, dot, corrcoef, diag
 from numpy.linalg import norm
 import scipy.linalg as LinAlg
 from thunder.factorization.ica import ICA
+from thunder.factorization.pca import PCA
 from thunder.factorization.svd import SVD
 from thunder.factorization.nmf import NMF
 from thunder.utils.datasets import DataSets
@@ -68,6 +69,65 @@ class TestSVD(FactorizationTestCase):
         assert(allclose(svd.s[0], sTrue[0], atol=tol))
         assert(allclose(vTest, vTrue[0, :], atol=tol) | allclose(-vTest, vTrue[0, :], atol=tol))
         assert(allclose(uTest, uTrue[:, 0], atol=tol) | allclose(-uTest, uTrue[:, 0], atol=tol))
+        assert(len(svd.convergence) == len(svd.iterTimes) <= 20)
+        assert(svd.convergence[-1] <= svd.tol or len(svd.convergence) == 20)
+        assert(not mat.rdd.is_cached)
+
+    def test_SvdEMUncachesOnError(self):
+        from numpy import zeros
+        from numpy.linalg import LinAlgError
+        from nose.tools import assert_raises
+        mat = RowMatrix(self.sc.parallelize(zip(range(4), zeros((4, 3)))))
+        # all-zero data make xx' singular
+        assert_raises(LinAlgError, SVD(k=1, method="em").calc, mat)
+        assert(not mat.rdd.is_cached)
+
+    def test_SvdTsqr(self):
+        # singular values spanning ten orders of magnitude, beyond the reach of the gramian
+        rs = random.RandomState(0)
+        u, _ = LinAlg.qr(rs.randn(200, 5), mode='economic')
+        v, _ = LinAlg.qr(rs.randn(5, 5))
+        sTrue = array([1.0, 1e-2, 1e-4, 1e-6, 1e-10])
+        dataLocal = dot(u * sTrue, v.T)
+        mat = RowMatrix(self.sc.parallelize(zip(range(200), dataLocal), 4))
+
+        svd = SVD(k=5, method="tsqr")
+        svd.calc(mat)
+        assert(allclose(svd.s / sTrue, 1, atol=1e-4))
+        for i in range(5):
+            uTest = transpose(array(svd.u.rows().collect()))[i]
+            assert(allclose(abs(dot(svd.v[i], v[:, i])), 1))
+            assert(allclose(abs(dot(uTest, u[:, i])), 1))
+
+    def test_SvdRandomized(self):
+        # low-rank matrix plus noise, with k much smaller than the number of columns
+        rs = random.RandomState(0)
+        dataLocal = dot(rs.randn(300, 4) * array([10.0, 8.0, 6.0, 4.0]), rs.randn(4, 50)) + 0.01 * rs.randn(300, 50)
+        mat = RowMatrix(self.sc.parallelize(zip(range(300), dataLocal), 4))
+        uTrue, sTrue, vTrue = LinAlg.svd(dataLocal, full_matrices=False)
+
+        svd = SVD(k=3, method="randomized", oversample=5, powerIters=2, seed=0)
+        svd.calc(mat)
+        assert(allclose(svd.s, sTrue[0:3]))
+        for i in range(3):
+            uTest = transpose(array(svd.u.rows().collect()))[i]
+            assert(allclose(abs(dot(svd.v[i], vTrue[i])), 1))
+            assert(allclose(abs(dot(uTest, uTrue[:, i])), 1))
+
+    def test_SvdRandomizedLowRank(self):
+        # exactly low-rank matrix, so that most random directions fall in its null space
+        rs = random.RandomState(0)
+        dataLocal = dot(rs.randn(300, 4) * array([10.0, 8.0, 6.0, 4.0]), rs.randn(4, 50))
+        mat = RowMatrix(self.sc.parallelize(zip(range(300), dataLocal), 4))
+        uTrue, sTrue, vTrue = LinAlg.svd(dataLocal, full_matrices=False)
+
+        svd = SVD(k=3, method="randomized", seed=0)
+        svd.calc(mat)
+        assert(allclose(svd.s, sTrue[0:3]))
+        for i in range(3):
+            uTest = transpose(array(svd.u.rows().collect()))[i]
+            assert(allclose(abs(dot(svd.v[i], vTrue[i])), 1))
+            assert(allclose(abs(dot(uTest, uTrue[:, i])), 1))
 
     def test_conversion(self):
         from thunder.rdds.series import Series
@@ -81,6 +141,43 @@ class TestSVD(FactorizationTestCase):
         SVD(k=1, method='direct').calc(data)
 
 
+class TestPCA(FactorizationTestCase):
+    def test_pcaImages(self):
+        # principal components over time of images match those of the pixel time series
+        from thunder.rdds.images import Images
+        from thunder.rdds.series import Series
+        rs = random.RandomState(0)
+        arys = [rs.randn(4, 5) + 10 for _ in range(12)]
+        images = Images(self.sc.parallelize(zip(range(12), arys), 3))
+        pixels = array(arys).reshape((12, -1)).T
+        series = Series(self.sc.parallelize(zip(range(20), pixels), 3))
+
+        pcaImages = PCA(k=3).fit(images)
+        pcaSeries = PCA(k=3).fit(series)
+        scores = array(pcaSeries.scores.rows().collect())
+        assert(allclose(pcaImages.latent, pcaSeries.latent))
+        assert(pcaImages.scores.shape == (3, 4, 5))
+        for i in range(3):
+            sign = dot(pcaImages.comps[i], pcaSeries.comps[i])
+            assert(allclose(abs(sign), 1))
+            assert(allclose(pcaImages.scores[i].ravel() * sign, scores[:, i]))
+
+    def test_pcaImagesRank(self):
+        from numpy import isfinite
+        from nose.tools import assert_raises
+        from thunder.rdds.images import Images
+        rs = random.RandomState(0)
+        # three images around their mean span only two dimensions
+        arys = [rs.randn(4, 5) for _ in range(3)]
+        images = Images(self.sc.parallelize(zip(range(3), arys), 2))
+        assert_raises(ValueError, PCA(k=3).fit, images)
+        # identical images have no variance
+        images = Images(self.sc.parallelize(zip(range(4), [arys[0]] * 4), 2))
+        pca = PCA(k=2).fit(images)
+        assert(allclose(pca.latent, 0))
+        assert(isfinite(pca.scores).all())
+
+
 class TestICA(FactorizationTestCase):
     """Test ICA results against ground truth,
     taking into account possible sign flips and permutations
@@ -105,6 +202,22 @@ class TestICA(FactorizationTestCase):
         # test accurate reconstruction from sources
         assert(allclose(array(data.rows().collect()), dot(s_, ica.a.T)))
 
+    def test_icaRandomized(self):
+
+        random.seed(42)
+        data, s, a = DataSets.make(self.sc, "ica", nrows=100, returnParams=True)
+
+        ica = ICA(c=2, svdMethod="randomized", seed=1)
+        ica.fit(data)
+
+        s_ = array(ica.sigs.rows().collect())
+
+        tol = 0.01
+        assert(allclose(abs(corrcoef(s[:, 0], s_[:, 0])[0, 1]), 1, atol=tol)
+               or allclose(abs(corrcoef(s[:, 0], s_[:, 1])[0, 1]), 1, atol=tol))
+        assert(allclose(abs(corrcoef(s[:, 1], s_[:, 0])[0, 1]), 1, atol=tol)
+               or allclose(abs(corrcoef(s[:, 1], s_[:, 1])[0, 1]), 1, atol=tol))
+
 
 class TestNMF(FactorizationTestCase):
     def test_als(self):
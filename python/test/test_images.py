@@ -299,6 +299,17 @@ class TestImagesMethods(PySparkTestCase):
     def test_maxminProjection(self):
         self._run_tst_maxProject(TestImagesMethods._run_maxminProject)
 
+    def test_gramian(self):
+        from numpy import dot
+        narys = 5
+        arys, sh, sz = _generateTestArrays(narys)
+        flat = array([ary.ravel() for ary in arys], dtype='float64')
+
+        imageData = ImagesLoader(self.sc).fromArrays(arys)
+        keys, gram = imageData.gramian()
+        assert_equals(range(narys), keys)
+        assert_true(allclose(dot(flat, flat.T), gram))
+
     def test_subsample(self):
         narys = 3
         arys, sh, sz = _generateTestArrays(narys)
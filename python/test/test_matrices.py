@@ -1,6 +1,6 @@
 import shutil
 import tempfile
-from numpy import array, array_equal, add
+from numpy import allclose, array, array_equal, add
 from thunder.rdds.matrices import RowMatrix
 from test_utils import PySparkTestCase
 
@@ -59,3 +59,45 @@ class TestOuter(MatrixRDDTestCase):
         assert array_equal(resultA, truth)
         assert array_equal(resultB1, truth)
         assert array_equal(resultB2, truth)
+
+    def test_outer_stacked(self):
+        from numpy import dot, random
+        rows = random.RandomState(0).randn(50, 6)
+        mat = RowMatrix(self.sc.parallelize(zip(range(50), rows), 4))
+        truth = dot(rows.T, rows)
+        assert allclose(mat.gramian("reduce"), truth)
+        assert allclose(mat.gramian("stacked", depth=3), truth)
+        assert allclose(mat.gramian("stacked", packed=True), truth)
+
+    def test_outer_stackedWithoutTreeAggregate(self):
+        # Spark releases before 1.3 have no RDD.treeAggregate
+        from numpy import dot, random
+        from pyspark import RDD
+        rows = random.RandomState(0).randn(50, 6)
+        mat = RowMatrix(self.sc.parallelize(zip(range(50), rows), 4))
+        treeAggregate = getattr(RDD, "treeAggregate", None)
+        if treeAggregate is not None:
+            del RDD.treeAggregate
+        try:
+            assert not hasattr(mat.rdd, "treeAggregate")
+            assert allclose(mat.gramian("stacked"), dot(rows.T, rows))
+        finally:
+            if treeAggregate is not None:
+                RDD.treeAggregate = treeAggregate
+
+
+class TestQR(MatrixRDDTestCase):
+
+    def test_qr(self):
+        from numpy import dot, eye, random, triu
+        from numpy.linalg import qr
+        rows = random.RandomState(0).randn(50, 6)
+        mat = RowMatrix(self.sc.parallelize(zip(range(50), rows), 4))
+        q, r = mat.qr(depth=3)
+        assert allclose(r, triu(r))
+        # unique up to the signs of the rows of r
+        assert allclose(abs(r), abs(qr(rows)[1]))
+        qLocal = array(q.rows().collect())
+        assert allclose(dot(qLocal, r), rows)
+        assert allclose(dot(qLocal.T, qLocal), eye(6))
+        assert array_equal(range(6), q.index)
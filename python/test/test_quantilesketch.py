@@ -0,0 +1,40 @@
+import unittest
+from numpy import array, array_equal, random
+from nose.tools import assert_equals, assert_raises, assert_true
+
+from thunder.utils.quantilesketch import QuantileSketch
+
+
+class TestQuantileSketch(unittest.TestCase):
+    def setUp(self):
+        random.seed(42)
+        self.arys = random.randn(5000, 3)
+
+    def test_exact(self):
+        sketch = QuantileSketch([1.0, 5.0, 3.0, 2.0, 4.0])
+        assert_equals(5, sketch.count())
+        assert_true(array_equal(array([1.0, 3.0, 5.0]), sketch.quantiles([0.0, 0.5, 1.0])))
+        assert_equals(2.0, sketch.quantiles(0.3))
+
+    def test_boundedSize(self):
+        sketch = QuantileSketch(k=32, seed=0).mergeBatch(self.arys)
+        assert_equals(5000, sketch.count())
+        assert_true(sum(level.shape[0] for level in sketch.levels) <= 32 * len(sketch.levels))
+        ranks = (self.arys < sketch.quantiles(0.5)).mean(axis=0)
+        assert_true(all(abs(ranks - 0.5) < 0.05))
+
+    def test_mergeSketch(self):
+        left = QuantileSketch(k=64, seed=0).mergeBatch(self.arys[:1234])
+        right = QuantileSketch(k=64, seed=1)
+        for ary in self.arys[1234:1300]:
+            right.merge(ary)
+        right.mergeBatch(self.arys[1300:])
+        merged = left.mergeSketch(right)
+        assert_equals(5000, merged.count())
+        assert_true(array_equal(self.arys.min(axis=0), merged.quantiles(0)))
+        assert_true(array_equal(self.arys.max(axis=0), merged.quantiles(1)))
+        ranks = (self.arys < merged.quantiles([0.1, 0.9])[:, None, :]).mean(axis=1)
+        assert_true(abs(ranks - array([[0.1], [0.9]])).max() < 0.03)
+
+    def test_empty(self):
+        assert_raises(ValueError, QuantileSketch().quantiles, 0.5)
@@ -1,4 +1,4 @@
-from numpy import allclose, amax, arange, array, array_equal
+from numpy import allclose, amax, arange, array, array_equal, zeros
 from numpy import dtype as dtypeFunc
 from nose.tools import assert_equals, assert_is_none, assert_is_not_none, assert_raises, assert_true
 
@@ -217,6 +217,23 @@ class TestSeriesMethods(PySparkTestCase):
         assert(allclose(values[0, :], array([1.5, 2., 3.5])))
         assert_equals(data.dtype, values[0, :].dtype)
 
+    def test_query_overlapping(self):
+        dataLocal = [
+            ((1,), array([1.0, 2.0, 3.0])),
+            ((2,), array([2.0, 2.0, 4.0])),
+            ((3,), array([4.0, 2.0, 1.0]))
+        ]
+
+        data = Series(self.sc.parallelize(dataLocal, 2))
+
+        inds = [[1, 2], [2, 3], [1, 2, 3], []]
+        keys, values = data.query(inds)
+        assert(allclose(keys[:, 0], array([1.5, 2.5, 2.0, 0.0])))
+        assert(allclose(values[0, :], array([1.5, 2., 3.5])))
+        assert(allclose(values[1, :], array([3.0, 2.0, 2.5])))
+        assert(allclose(values[2, :], array([7.0 / 3, 2.0, 8.0 / 3])))
+        assert(allclose(values[3, :], array([0.0, 0.0, 0.0])))
+
     def test_maxProject(self):
         from thunder.rdds.fileio.seriesloader import SeriesLoader
         ary = arange(8, dtype=dtypeFunc('int16')).reshape((2, 4))
@@ -249,6 +266,231 @@ class TestSeriesMethods(PySparkTestCase):
         assert_raises(ValueError, setIndex, data, 5)
         assert_raises(ValueError, setIndex, data, [1, 2])
 
+    def test_packUnordered(self):
+        ary = arange(24, dtype=dtypeFunc('float32')).reshape((2, 3, 4))
+        dataLocal = [((x, y), ary[:, y, x]) for x in xrange(4) for y in xrange(3)]
+        series = Series(self.sc.parallelize(dataLocal[::-1], 3))
+        packed = series.pack()
+        assert_equals('float32', str(packed.dtype))
+        assert_true(array_equal(ary.transpose((0, 2, 1)), packed))
+        assert_true(array_equal(ary, series.pack(transpose=True)))
+        assert_true(array_equal(ary[1].T, series.pack(selection=1)))
+
+    def test_packMemmap(self):
+        import os
+        import shutil
+        import tempfile
+        from numpy import memmap
+        ary = arange(24, dtype=dtypeFunc('float64')).reshape((2, 12))
+        series = Series(self.sc.parallelize([((x,), ary[:, x]) for x in xrange(12)], 2))
+        outputDir = tempfile.mkdtemp()
+        try:
+            packed = series.pack(memmapPath=os.path.join(outputDir, 'packed.dat'))
+            assert_true(isinstance(packed, memmap))
+            assert_true(array_equal(ary, packed))
+            del packed
+        finally:
+            shutil.rmtree(outputDir)
+
+    def test_indexByKey(self):
+        ary = arange(24, dtype=dtypeFunc('float64')).reshape((2, 3, 4))
+        dataLocal = [((x, y), ary[:, y, x]) for x in xrange(4) for y in xrange(3)]
+        series = Series(self.sc.parallelize(dataLocal[::-1], 2))
+        indexed = series.indexByKey(npartitions=4).center()
+
+        assert_equals([3], indexed._partitionsOf([(1, 2)]))
+        assert_equals([3], indexed._partitionsOf([(7, 7)]))
+        assert_equals([0, 1, 2], indexed._partitionsOfRange([slice(1, 3), slice(0, 2)]))
+        for (k, v) in dataLocal:
+            assert_true(array_equal(v - v.mean(), indexed.get(k)))
+            assert_true(array_equal(v - v.mean(), indexed[k]))
+        assert_is_none(indexed.get((7, 7)))
+        vals = indexed.getMany([(3, 2), (0, 0), (7, 7)])
+        assert_true(array_equal(ary[:, 2, 3] - ary[:, 2, 3].mean(), vals[0]))
+        assert_true(array_equal(ary[:, 0, 0] - ary[:, 0, 0].mean(), vals[1]))
+        assert_is_none(vals[2])
+        expected = series.center().getRange([slice(1, 3), slice(0, 2)])
+        actual = indexed.filterOnKeys(lambda k: k[0] > 0).getRange([slice(1, 3), slice(0, 2)])
+        assert_equals([k for k, _ in expected], [k for k, _ in actual])
+
+    def test_indexByKeyAfterApplyKeys(self):
+        ary = arange(24, dtype=dtypeFunc('float64')).reshape((2, 3, 4))
+        dataLocal = [((x, y), ary[:, y, x]) for x in xrange(4) for y in xrange(3)]
+        series = Series(self.sc.parallelize(dataLocal, 2), dims=(4, 3))
+        # dims carried over from before the keys changed no longer hold them
+        shifted = series.applyKeys(lambda (x, y): (x - 2, y + 1)).indexByKey(npartitions=3)
+        assert_equals((4, 3), shifted._dims.count)
+        for (x, y), v in dataLocal:
+            assert_true(array_equal(v, shifted.get((x - 2, y + 1))))
+        assert_equals(sorted([(x - 2, y + 1) for (x, y), _ in dataLocal]),
+                      sorted([k for k, _ in shifted.getRange([slice(-2, 2), slice(1, 4)])]))
+        assert_equals(12, shifted.count())
+
+    def test_sortByKey(self):
+        from numpy import random
+        keys = [(x, y, z) for x in xrange(3) for y in xrange(2) for z in xrange(4)]
+        random.shuffle(keys)
+        dataLocal = [(k, array([float(i)])) for i, k in enumerate(keys)]
+        expected = Series(self.sc.parallelize(dataLocal, 3)).sortByKey().collect()
+        data = Series(self.sc.parallelize(dataLocal, 3), dims=(3, 2, 4))
+        actual = data.sortByKey()
+        assert_is_not_none(actual._keyIndex)
+        assert_equals([k for k, _ in expected], actual.keys().collect())
+        assert_equals([v[0] for _, v in expected], [v[0] for v in actual.values().collect()])
+        assert_equals(sorted(keys, key=lambda k: k[::-1]), [k for k, _ in data.collect(sorting=True)])
+
+        # dims carried over from before the keys changed no longer hold them
+        shifted = data.applyKeys(lambda (x, y, z): (x + 5, y, z))
+        assert_equals((3, 2, 4), shifted._dims.count)
+        assert_equals(sorted([(x + 5, y, z) for x, y, z in keys], key=lambda k: k[::-1]),
+                      shifted.sortByKey().keys().collect())
+        interleaved = data.applyKeys(lambda (x, y, z): (x - 1, y, z)).sortByKey()
+        assert_is_not_none(interleaved._keyIndex)
+        assert_equals(sorted([(x - 1, y, z) for x, y, z in keys], key=lambda k: k[::-1]),
+                      interleaved.keys().collect())
+
+    def test_dims(self):
+        dataLocal = [
+            ((1, 5), array([1.0])),
+            ((3, 2), array([2.0])),
+            ((2, 4), array([4.0]))
+        ]
+        data = Series(self.sc.parallelize(dataLocal, 2))
+        assert_equals((1, 2), data.dims.min)
+        assert_equals((3, 5), data.dims.max)
+        assert_equals((3, 4), data.dims.count)
+
+    def test_metadataPropagation(self):
+        from thunder.rdds.fileio.seriesloader import SeriesLoader
+        ary = arange(6, dtype=dtypeFunc('int16')).reshape((2, 3))
+        series = SeriesLoader(self.sc).fromArrays([ary, ary + 1, ary + 2])
+        out = series.astype('float32').center().filterOnValues(lambda v: v[0] > 1)
+        out = out.applyValues(lambda v: v[:2], inferMetadata=True)
+        assert_equals('float32', out._dtype)
+        assert_true(array_equal(arange(2), out._index))
+        assert_equals(2, out._nkeys)
+        assert_is_none(out._dims)
+
+        # functions of the keys may change their number
+        rekeyed = series.applyKeys(lambda k: (k[0], k[1], 0))
+        assert_is_none(rekeyed._nkeys)
+        rekeyed.populateParamsFromFirstRecord()
+        assert_equals(3, rekeyed._nkeys)
+
+    def test_applyValuesIsLazy(self):
+        from thunder.rdds.fileio.seriesloader import SeriesLoader
+        ary = arange(6, dtype=dtypeFunc('float64')).reshape((2, 3))
+        series = SeriesLoader(self.sc).fromArrays([ary, ary + 1, ary + 2])
+        calls = []
+
+        def nonzero(v):
+            calls.append(v)
+            return v[v > 2]
+
+        out = series.applyValues(nonzero)
+        assert_equals([], calls)
+        assert_is_none(out._dtype)
+        assert_is_none(out._index)
+        # the index comes from the data, whose output lengths vary
+        assert_equals(len(out.first()[1]), len(out.index))
+
+
+class TestSeriesVectorized(PySparkTestCase):
+    """Check that vectorized execution matches the per-record path"""
+    def setUp(self):
+        super(TestSeriesVectorized, self).setUp()
+        self.dataLocal = [
+            ((0, 0), array([1.0, 2.0, 3.0, 8.0])),
+            ((0, 1), array([2.0, 2.0, 4.0, 1.0])),
+            ((1, 0), array([4.0, 2.0, 1.0, 0.0])),
+            ((1, 1), array([3.0, 1.0, 1.0, 5.0]))
+        ]
+
+    def _checkVectorized(self, func):
+        rdd = self.sc.parallelize(self.dataLocal, 2)
+        expected = func(Series(rdd)).collect()
+        actual = func(Series(rdd).vectorize()).collect()
+        assert_equals(len(expected), len(actual))
+        for (expectedKey, expectedVal), (actualKey, actualVal) in zip(expected, actual):
+            assert_equals(expectedKey, actualKey)
+            assert_true(allclose(expectedVal, actualVal))
+
+    def test_vectorizedPropagates(self):
+        data = Series(self.sc.parallelize(self.dataLocal)).vectorize()
+        assert_true(data.center()._vectorized)
+        assert_true(data.seriesMean()._vectorized)
+        assert_true(not data.vectorize(False).center()._vectorized)
+
+    def test_center(self):
+        self._checkVectorized(lambda data: data.center(0))
+        self._checkVectorized(lambda data: data.center(1))
+
+    def test_zscore(self):
+        self._checkVectorized(lambda data: data.standardize(0))
+        self._checkVectorized(lambda data: data.zscore(0))
+
+    def test_seriesStats(self):
+        for stat in ('sum', 'mean', 'median', 'stdev', 'max', 'min', 'count'):
+            self._checkVectorized(lambda data: data.seriesStat(stat))
+        self._checkVectorized(lambda data: data.seriesStats())
+        self._checkVectorized(lambda data: data.seriesPercentile(25))
+
+    def test_correlate(self):
+        self._checkVectorized(lambda data: data.correlate([4, 5, 6, 7]))
+        self._checkVectorized(lambda data: data.correlate([[4, 5, 6, 7], [8, 7, 6, 9]]))
+
+    def test_chained(self):
+        self._checkVectorized(lambda data: data.center().applyValues(lambda x: x * 2).zscore().seriesMax())
+        self._checkVectorized(lambda data: data.select([0, 2, 3]).seriesStats())
+
+
+class TestSeriesLazyTransforms(PySparkTestCase):
+    def setUp(self):
+        super(TestSeriesLazyTransforms, self).setUp()
+        self.dataLocal = [
+            ((0,), array([1.0, 2.0, 3.0, 8.0])),
+            ((1,), array([2.0, 2.0, 4.0, 1.0])),
+            ((2,), array([4.0, 2.0, 1.0, 0.0]))
+        ]
+
+    def test_fused(self):
+        data = Series(self.sc.parallelize(self.dataLocal, 2))
+        out = data.center().applyValues(lambda x: x + 1).seriesSum()
+        assert_equals(3, len(out._pending))
+        assert_equals(0, len(data._pending))
+        assert_true(allclose([4.0, 4.0, 4.0], out.values().collect()))
+        assert_equals(0, len(out._pending))
+
+    def test_cachedAfterDerived(self):
+        data = Series(self.sc.parallelize(self.dataLocal, 2))
+        calls = []
+
+        def addOne(x):
+            calls.append(x)
+            return x + 1
+
+        first = data.applyValues(addOne)
+        second = first.applyValues(lambda x: x * 2)
+        # caching the parent after deriving from it is still used by the derived object
+        first.cache()
+        assert_true(allclose([2.0, 3.0, 4.0, 9.0], first.values().first()))
+        assert_true(allclose([4.0, 6.0, 8.0, 18.0], second.values().first()))
+        assert_true(second.rdd is not first.rdd)
+        second.count()
+        assert_equals(3, len(calls))
+
+    def test_metadataWithoutData(self):
+        data = Series(self.sc.parallelize(self.dataLocal, 2), dtype='float64', index=['a', 'b', 'c', 'd'])
+        centered = data.center()
+        assert_equals(['a', 'b', 'c', 'd'], centered._index)
+        assert_equals('float64', centered._dtype)
+        stat = centered.seriesStat('count')
+        assert_equals(['count'], stat._index)
+        assert_equals(dtypeFunc('int64'), dtypeFunc(stat._dtype))
+        selected = data.select('b')
+        assert_equals(['b'], selected._index)
+        assert_true(allclose([2.0, 2.0, 2.0], selected.values().collect()))
+
 
 class TestSeriesRegionMeanMethods(PySparkTestCase):
     def setUp(self):
@@ -379,3 +621,32 @@ class TestSeriesRegionMeanMethods(PySparkTestCase):
         self.__checkReturnedSeriesAttributes(actualSeries)
         TestSeriesRegionMeanMethods.__checkNestedAsserts(2, expectedKeys, expected, actual)
 
+
+    def test_meanByRegions_labelMask(self):
+        from numpy import random
+        ary = random.randn(6, 4, 5)
+        dataLocal = [((x, y), ary[:, x, y]) for x in xrange(4) for y in xrange(5)]
+        series = Series(self.sc.parallelize(dataLocal, 3), dtype='float64', index=arange(6))
+        mask = zeros((4, 5), dtype='int16')
+        mask[0, :] = 3
+        mask[2:, 1:3] = 7
+        mask[3, 4] = 9
+
+        actual = series.meanByRegions(mask, validate=True).collect()
+        assert_equals(3, len(actual))
+        for (actualKey, actualVal), label in zip(actual, [3, 7, 9]):
+            x, y = (mask == label).nonzero()
+            assert_equals(tuple(vstack([x, y]).mean(axis=1).astype('int16')), actualKey)
+            assert_true(allclose(ary[:, x, y].mean(axis=1), actualVal))
+
+        # means of integer values are not truncated to the input dtype
+        ints = Series(self.sc.parallelize([((x,), array([x, 2 * x + 1], dtype='int16')) for x in xrange(5)], 2),
+                      dtype='int16', index=arange(2))
+        means = ints.meanByRegions(array([1, 2, 1, 2, 2], dtype='int16'))
+        assert_equals('float64', means.dtype)
+        assert_true(allclose([[1.0, 8.0 / 3], [3.0, 19.0 / 3]], means.pack()))
+
+        # a record missing from a region raises an error on the driver when validating
+        missing = Series(self.sc.parallelize(dataLocal[1:], 3))
+        assert_raises(ValueError, missing.meanByRegions, mask, validate=True)
+        assert_equals(3, len(missing.meanByRegions(mask).collect()))
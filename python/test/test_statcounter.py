@@ -0,0 +1,31 @@
+import unittest
+from numpy import allclose, array_equal, random
+from nose.tools import assert_equals, assert_raises, assert_true
+
+from thunder.utils.statcounter import StatCounter
+
+
+class TestStatCounterBatch(unittest.TestCase):
+    def setUp(self):
+        random.seed(42)
+        self.arys = [random.randn(4) for _ in xrange(20)]
+
+    def test_mergeBatchMatchesMerge(self):
+        expected = StatCounter(self.arys)
+        actual = StatCounter().mergeBatch(self.arys[:7]).mergeBatch(self.arys[7:])
+        assert_equals(expected.count(), actual.count())
+        assert_true(allclose(expected.mean(), actual.mean()))
+        assert_true(allclose(expected.variance(), actual.variance()))
+        assert_true(array_equal(expected.max(), actual.max()))
+        assert_true(array_equal(expected.min(), actual.min()))
+
+    def test_mergeBatchScalars(self):
+        vals = [1.0, 2.0, 6.0, 3.0]
+        counter = StatCounter().mergeBatch(vals)
+        assert_true(allclose(3.0, counter.mean()))
+        assert_true(allclose(3.5, counter.variance()))
+
+    def test_mergeBatchRequestedStats(self):
+        counter = StatCounter(stats='mean').mergeBatch(self.arys)
+        assert_true(allclose(sum(self.arys) / len(self.arys), counter.mean()))
+        assert_raises(ValueError, counter.max)
@@ -1,6 +1,6 @@
 import shutil
 import tempfile
-from numpy import array, allclose, corrcoef
+from numpy import array, allclose, arange, asarray, corrcoef
 from thunder.rdds.timeseries import TimeSeries
 from test_utils import PySparkTestCase
 from nose.tools import assert_equals
@@ -31,6 +31,25 @@ class TestTimeSeriesMethods(TimeSeriesTestCase):
         assert(allclose(vals.select('coherence').values().collect()[0], 0.578664))
         assert(allclose(vals.select('phase').values().collect()[0], 4.102501))
 
+    def test_fourier_multiple(self):
+        dataLocal = [
+            array([1.0, 2.0, -4.0, 5.0, 8.0, 3.0, 4.1, 0.9, 2.3]),
+            array([2.0, 2.0, -4.0, 5.0, 3.1, 4.5, 8.2, 8.1, 9.1]),
+        ]
+        rdd = self.sc.parallelize(zip(range(1, 3), dataLocal))
+        data = TimeSeries(rdd)
+        vals = data.fourier(freq=[1, 2, 3])
+        assert_equals([('coherence', 1), ('coherence', 2), ('coherence', 3), ('phase', 1), ('phase', 2),
+                       ('phase', 3)], vals.index)
+        assert(allclose(vals.select([('coherence', 2)]).values().collect()[0], 0.578664))
+        assert(allclose(vals.select([('phase', 2)]).values().collect()[0], 4.102501))
+        allVals = data.fourier(freq='all').values().collect()
+        assert_equals(8, len(allVals[0]))
+        # the phase at frequency 0 is that of a zero coefficient, and so arbitrary
+        for f in range(1, 4):
+            single = data.fourier(freq=f).values().collect()
+            assert(allclose(array(single), array(allVals)[:, [f, f + 4]]))
+
     def test_convolve(self):
         dataLocal = array([1, 2, 3, 4, 5])
         sig = array([1, 2, 3])
@@ -38,6 +57,32 @@ class TestTimeSeriesMethods(TimeSeriesTestCase):
         data = TimeSeries(rdd)
         betas = data.convolve(sig, mode='same')
         assert(allclose(betas.values().collect()[0], array([4, 10, 16, 22, 22])))
+        assert_equals('float64', str(betas.dtype))
+        assert_equals('float64', str(betas.values().collect()[0].dtype))
+
+    def test_convolve_methods(self):
+        from numpy import convolve
+        from numpy.random import RandomState
+        from scipy.io import savemat
+        import os
+        rs = RandomState(0)
+        dataLocal = rs.randn(3, 40)
+        kernels = rs.randn(2, 12)
+        rdd = self.sc.parallelize(zip(range(3), dataLocal))
+        data = TimeSeries(rdd)
+        for mode in ['full', 'same', 'valid']:
+            expected = array([[convolve(y, k, mode) for k in kernels] for y in dataLocal]).reshape((3, -1))
+            for method in ['direct', 'fft']:
+                out = data.convolve(kernels, mode=mode, method=method)
+                assert_equals(expected.shape[1], len(out.index))
+                assert(allclose(array(out.values().collect()), expected))
+                assert(allclose(array(out.vectorize().values().collect()), expected))
+
+        path = os.path.join(self.outputdir, 'kernel.mat')
+        savemat(path, {'k': kernels[0]})
+        out = data.convolve(path, var='k', mode='same')
+        assert_equals(40, len(out.index))
+        assert(allclose(out.values().collect()[0], convolve(dataLocal[0], kernels[0], 'same')))
 
     def test_crossCorr(self):
         dataLocal = array([
@@ -54,17 +99,134 @@ class TestTimeSeriesMethods(TimeSeriesTestCase):
 
         assert(allclose(betas.values().collect()[0], corrcoef(dataLocal[0, :], sig)[0, 1]))
         assert(allclose(betas.values().collect()[1], corrcoef(dataLocal[1, :], sig)[0, 1]))
+        # a single signal without lags gives a scalar per record, as it always has
+        assert_equals([0], betas.index)
+        for series in [data, data.vectorize()]:
+            values = series.crossCorr(signal=sig, lag=0).values().collect()
+            assert_equals([(), ()], [asarray(v).shape for v in values])
+            assert(allclose(values, [0.99222, 0.44778], atol=1e-5))
 
         betas = data.crossCorr(signal=sig, lag=2)
         tol = 1E-5  # to handle rounding errors
         assert(allclose(betas.values().collect()[0], array([-0.18511, 0.03817, 0.99221, 0.06567, -0.25750]), atol=tol))
         assert(allclose(betas.values().collect()[1], array([-0.35119, -0.14190, 0.44777, -0.00408, 0.45435]), atol=tol))
 
+    def test_crossCorr_methods(self):
+        from numpy.random import RandomState
+        rs = RandomState(0)
+        dataLocal = rs.randn(3, 20)
+        sigs = rs.randn(2, 20)
+        rdd = self.sc.parallelize(zip(range(3), dataLocal))
+        data = TimeSeries(rdd)
+        for lag in [0, 3, 19]:
+            direct = data.crossCorr(sigs, lag=lag, method='direct')
+            viaFFT = data.crossCorr(sigs, lag=lag, method='fft')
+            assert(allclose(array(direct.values().collect()), array(viaFFT.values().collect())))
+            assert(allclose(array(viaFFT.values().collect()),
+                            array(viaFFT.vectorize().values().collect())))
+        single = data.crossCorr(sigs[1], lag=3, method='fft').values().collect()
+        both = data.crossCorr(sigs, lag=3)
+        assert_equals([(0, -3), (0, -2)], both.index[:2])
+        both = both.values().collect()
+        assert(allclose(array(single), array(both)[:, 7:]))
+        assert_equals(range(2), data.crossCorr(sigs, lag=0).index)
+
+    def test_resample(self):
+        from numpy.random import RandomState
+        from scipy.signal import resample_poly
+        dataLocal = RandomState(0).randn(3, 101)
+        data = TimeSeries(self.sc.parallelize(zip(range(3), dataLocal)), index=arange(101) * 0.5)
+        out = data.resample(0.5)
+        assert(allclose(arange(51), out.index))
+        assert(allclose(resample_poly(dataLocal, 1, 2, axis=1), array(out.values().collect())))
+        out = data.vectorize().resample(rate=3.0, fs=2.0)
+        assert_equals(152, len(out.index))
+        assert(allclose(1.0 / 3, out.index[1]))
+        assert(allclose(resample_poly(dataLocal, 3, 2, axis=1), array(out.values().collect())))
+
+    def test_temporalFilter(self):
+        from numpy.random import RandomState
+        from scipy.signal import butter, sosfiltfilt, firwin, filtfilt
+        dataLocal = RandomState(0).randn(3, 101)
+        data = TimeSeries(self.sc.parallelize(zip(range(3), dataLocal)))
+        sos = butter(4, [0.1, 0.4], btype='bandpass', output='sos')
+        out = data.temporalFilter('bandpass', (0.05, 0.2))
+        assert(allclose(data.index, out.index))
+        assert(allclose(sosfiltfilt(sos, dataLocal, axis=1), array(out.values().collect())))
+        taps = firwin(21, 0.5, pass_zero=False)
+        out = data.vectorize().temporalFilter('highpass', 2.5, order=20, method='fir', fs=10.0)
+        assert(allclose(filtfilt(taps, [1.0], dataLocal, axis=1), array(out.values().collect())))
+
+    def test_psd(self):
+        from numpy.random import RandomState
+        from scipy.signal import welch
+        dataLocal = RandomState(0).randn(3, 300)
+        data = TimeSeries(self.sc.parallelize(zip(range(3), dataLocal)))
+        freqs, expected = welch(dataLocal, fs=2.0, nperseg=64, noverlap=16, axis=-1)
+        for series in [data, data.vectorize()]:
+            out = series.psd(nperseg=64, noverlap=16, fs=2.0)
+            assert(allclose(freqs, out.index))
+            assert(allclose(expected, array(out.values().collect())))
+
+    def test_coherence(self):
+        from numpy.random import RandomState
+        from scipy.signal import coherence
+        rs = RandomState(0)
+        dataLocal = rs.randn(3, 300)
+        sigs = rs.randn(2, 300) + dataLocal[:2]
+        data = TimeSeries(self.sc.parallelize(zip(range(3), dataLocal)))
+        freqs, expected = coherence(dataLocal[2], sigs[1], nperseg=50)
+        out = data.coherence(sigs[1], nperseg=50)
+        assert(allclose(freqs, out.index))
+        assert(allclose(expected, out.values().collect()[2]))
+        both = data.coherence(sigs, nperseg=50)
+        assert_equals((1, freqs[0]), both.index[len(freqs)])
+        assert(allclose(expected, array(both.vectorize().values().collect())[2, len(freqs):]))
+
     def test_detrend(self):
         rdd = self.sc.parallelize([(0, array([1, 2, 3, 4, 5]))])
         data = TimeSeries(rdd).detrend('linear')
         # detrending linearly increasing data should yield all 0s
         assert(allclose(data.first()[1], array([0, 0, 0, 0, 0])))
+        # unknown keyword arguments are ignored
+        data = TimeSeries(rdd).detrend('linear', order=3, window=10)
+        assert(allclose(data.first()[1], array([0, 0, 0, 0, 0])))
+
+    def test_detrend_bases(self):
+        from numpy import cos, pi, polyfit, polyval
+        x = arange(1, 101)
+        y = 3 + 0.5 * cos(pi * x / 100.0) + 0.1 * cos(pi * x)
+        rdd = self.sc.parallelize([(0, y)])
+        data = TimeSeries(rdd)
+        p = polyfit(x, y, 3)
+        p[-1] = 0
+        assert(allclose(data.detrend('nonlin', order=3).first()[1], y - polyval(p, x)))
+        # slow components are removed, the mean and fast components are kept
+        for method in ['spline', 'cosine']:
+            out = data.detrend(method).first()[1]
+            assert(allclose(out.mean(), y.mean()))
+            assert(allclose(out, 3 + 0.1 * cos(pi * x), atol=0.05))
+
+    def test_deconvolve(self):
+        from numpy import zeros
+        from numpy.random import RandomState
+        rs = RandomState(0)
+        spikes = (rs.rand(2, 500) < 0.05) * (1 + rs.rand(2, 500))
+        calcium = zeros((2, 500))
+        calcium[:, 0] = spikes[:, 0]
+        for t in range(1, 500):
+            calcium[:, t] = 0.8 * calcium[:, t-1] + spikes[:, t]
+        rdd = self.sc.parallelize(zip(range(2), calcium))
+        data = TimeSeries(rdd)
+        # without noise the trace itself is the solution
+        assert(allclose(array(data.deconvolve(g=0.8).values().collect()), spikes))
+        assert(allclose(array(data.deconvolve(g=0.8, output='calcium').values().collect()), calcium))
+
+        noisy = TimeSeries(self.sc.parallelize(zip(range(2), calcium + 0.1 * rs.randn(2, 500))))
+        out = array(noisy.deconvolve(penalty=0.5).values().collect())
+        assert(out.min() >= 0)
+        assert(allclose(out, spikes, atol=0.5))
+        assert(allclose(out, array(noisy.vectorize().deconvolve(penalty=0.5).values().collect())))
 
     def test_normalization_bypercentile(self):
         rdd = self.sc.parallelize([(0, array([1, 2, 3, 4, 5], dtype='float16'))])
@@ -104,7 +266,30 @@ class TestTimeSeriesMethods(TimeSeriesTestCase):
         result_true = (y - b_true) / (b_true + 0.1)
         assert(allclose(vals, result_true, atol=1e-3))
 
-        
+
+    def test_normalization_bywindow_long(self):
+        from numpy.random import RandomState
+        from numpy import percentile
+        y = RandomState(0).randn(20, 100)
+        rdd = self.sc.parallelize(zip([(i,) for i in range(20)], y), 1)
+        for window in [5, 8, 150]:
+            expected = asarray([[percentile(v[max(ix-window/2, 0):ix+window/2+1+(window & 0x1)], 30)
+                                 for ix in range(100)] for v in y])
+            expected = (y - expected) / (expected + 0.1)
+            out = TimeSeries(rdd).normalize('window', window=window, perc=30).values().collect()
+            assert(allclose(array(out), expected))
+            out = TimeSeries(rdd).vectorize().normalize('window', window=window, perc=30).values().collect()
+            assert(allclose(array(out), expected))
+
+    def test_normalization_decimated(self):
+        y = arange(60, dtype='float64') % 10
+        rdd = self.sc.parallelize([(0, y)])
+        data = TimeSeries(rdd)
+        out = data.normalize('window', window=20, decimate=10).first()[1]
+        # block means are constant, so the interpolated baseline is too
+        assert(allclose(out, (y - 4.5) / 4.6))
+        expected = data.normalize('window', window=8).first()[1]
+        assert(allclose(data.normalize('window', window=8, decimate=1).first()[1], expected))
 
     def test_normalization_bymean(self):
         rdd = self.sc.parallelize([(0, array([1, 2, 3, 4, 5], dtype='float16'))])
@@ -115,7 +300,54 @@ class TestTimeSeriesMethods(TimeSeriesTestCase):
         assert(allclose(out.first()[1],
                         array([-0.64516,  -0.32258,  0.0,  0.32258,  0.64516]), atol=1e-3))
 
-    # TODO add test for triggered average
+    def test_vectorized(self):
+        dataLocal = [
+            ((0,), array([1.0, 2.0, -4.0, 5.0, 8.0, 3.0, 4.1, 0.9, 2.3])),
+            ((1,), array([2.0, 2.0, -4.0, 5.0, 3.1, 4.5, 8.2, 8.1, 9.1])),
+            ((2,), array([0.5, 1.0, 3.0, 2.0, 0.0, 1.5, 2.5, 1.0, 0.5]))
+        ]
+        sig = array([1.5, 2.1, -4.2, 5.6, 8.1, 3.9, 4.2, 0.3, 2.1])
+        methods = [
+            lambda data: data.fourier(freq=2),
+            lambda data: data.fourier(freq='all'),
+            lambda data: data.crossCorr(sig, lag=0),
+            lambda data: data.crossCorr(sig, lag=2),
+            lambda data: data.detrend('nonlin', order=2),
+            lambda data: data.normalize('percentile'),
+            lambda data: data.normalize('window', window=4),
+            lambda data: data.normalize('window-fast', window=3)
+        ]
+        rdd = self.sc.parallelize(dataLocal, 2)
+        for method in methods:
+            expected = method(TimeSeries(rdd)).values().collect()
+            actual = method(TimeSeries(rdd).vectorize()).values().collect()
+            assert(allclose(array(expected), array(actual)))
 
-    # TODO add test for blocked averaged
+    def test_triggeredAverage(self):
+        y = arange(10, dtype='float64')
+        rdd = self.sc.parallelize([(0, y), (1, 2 * y)])
+        data = TimeSeries(rdd)
+        out = data.triggeredAverage([2, 5], lag=1)
+        assert_equals([-1, 0, 1], out.index)
+        assert(allclose(out.values().collect()[0], array([2.5, 3.5, 4.5])))
+
+        out = data.triggeredAverage({'a': [2, 5], 'b': [0, 9]}, lag=1)
+        assert_equals([('a', -1), ('a', 0), ('a', 1), ('b', -1), ('b', 0), ('b', 1)], out.index)
+        # events near the ends average only the lags that fall within the series
+        expected = array([2.5, 3.5, 4.5, 8.0, 4.5, 1.0])
+        assert(allclose(out.values().collect()[0], expected))
+        assert(allclose(out.vectorize().values().collect()[1], 2 * expected))
+
+        # a condition without events
+        out = data.triggeredAverage({'a': [2, 5], 'b': []}, lag=1)
+        assert(allclose(out.values().collect()[0][:3], array([2.5, 3.5, 4.5])))
+
+    def test_blockedAverage(self):
+        y = arange(12, dtype='float64')
+        rdd = self.sc.parallelize([(0, y), (1, 2 * y)])
+        data = TimeSeries(rdd)
+        out = data.blockedAverage(4)
+        assert_equals(range(4), out.index)
+        assert(allclose(out.values().collect()[0], array([4.0, 5.0, 6.0, 7.0])))
+        assert(allclose(out.vectorize().values().collect()[1], array([8.0, 10.0, 12.0, 14.0])))
 
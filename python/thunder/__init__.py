@@ -18,6 +18,7 @@ from thunder.rdds.series import Series
 from thunder.rdds.spatialseries import SpatialSeries
 from thunder.rdds.timeseries import TimeSeries
 from thunder.rdds.matrices import RowMatrix
+from thunder.rdds.blockedseries import BlockedSeries
 from thunder.rdds.images import Images
 
 # utilities
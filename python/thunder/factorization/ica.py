@@ -22,7 +22,7 @@ class ICA(object):
         Number of independent components to estimate
 
     svdMethod : string, optional, default = "direct"
-        Which SVD method to use
+        Which SVD method to use, "direct", "tsqr", "randomized", or "em", see SVD
 
     maxIter : Int, optional, default = 10
         Maximum number of iterations
@@ -5,6 +5,8 @@ Class for Principal Component Analysis
 from thunder.factorization.svd import SVD
 from thunder.rdds.series import Series
 from thunder.rdds.matrices import RowMatrix
+from thunder.rdds.images import Images
+from thunder.utils.common import treeReduce
 
 
 class PCA(object):
@@ -17,7 +19,8 @@ class PCA(object):
         Number of principal components to estimate
 
     svdMethod : str, optional, default = "direct"
-        Which method to use for performing the SVD
+        Which method to use for performing the SVD, "direct", "tsqr", "randomized", or "em",
+        see SVD
 
     Attributes
     ----------
@@ -28,7 +31,8 @@ class PCA(object):
         The latent values
 
     `scores` : RowMatrix, nrows, each of shape (k,)
-        The scores (i.e. the representation of the data in PC space)
+        The scores (i.e. the representation of the data in PC space), or
+        for Images, an array of shape (k,) + image dimensions with one spatial map per component
 
     See also
     --------
@@ -46,16 +50,23 @@ class PCA(object):
         """
         Estimate principal components
 
+        Images are treated as the equivalent Series of pixel time series, with principal components
+        over time, but without converting to Series: the time-by-time gramian is computed directly from
+        the images and decomposed locally, so `svdMethod` is not used.
+
         Parameters
         ----------
-        data : Series or a subclass (e.g. RowMatrix)
+        data : Series or a subclass (e.g. RowMatrix), or Images
             Data to estimate independent components from, must be a collection of
             key-value pairs where the keys are identifiers and the values are
             one-dimensional arrays
         """
 
+        if isinstance(data, Images):
+            return self._fitImages(data)
+
         if not (isinstance(data, Series)):
-            raise Exception('Input must be Series or a subclass (e.g. RowMatrix)')
+            raise Exception('Input must be Series or a subclass (e.g. RowMatrix), or Images')
 
         if type(data) is not RowMatrix:
             data = data.toRowMatrix()
@@ -71,6 +82,45 @@ class PCA(object):
 
         return self
 
+    def _fitImages(self, data):
+        """
+        Estimate principal components over time from the gramian of the images
+        """
+        from numpy import argsort, clip, dot, ones, outer, sqrt, where
+        from numpy.linalg import eigh
+
+        keys, gram = data.gramian()
+        n = len(keys)
+        if self.k > n - 1:
+            raise ValueError("Number of principal components, %d, must be less than the number of images, %d"
+                             % (self.k, n))
+
+        # centering each pixel time series is a double centering of the gramian, gram -> j gram j
+        center = -ones((n, n)) / n
+        center.flat[::n+1] += 1
+        gram = dot(center, dot(gram, center))
+
+        # the centered gramian is positive semidefinite, up to rounding
+        eigw, eigv = eigh(gram)
+        eigw = clip(eigw, 0, None)
+        inds = argsort(eigw)[::-1][0:self.k]
+        s = sqrt(eigw[inds])
+        v = eigv[:, inds].T
+
+        # the scores of each pixel are a weighted sum over images, with centered weights,
+        # and are zero for components without variance
+        weights = dot(center, v.T / where(s > 0, s, 1))
+        weightsByKey = data.rdd.context.broadcast(dict(zip(keys, weights)))
+        dims = data.dims.count
+        scores = treeReduce(data.rdd.map(lambda (k, im): outer(weightsByKey.value[k], im.ravel())),
+                            lambda x, y: x + y)
+
+        self.scores = scores.reshape((self.k,) + tuple(dims))
+        self.latent = s
+        self.comps = v
+
+        return self
+
     def transform(self, data):
         """
         Project data into principal component space
@@ -2,10 +2,11 @@
 Class for performing Singular Value Decomposition
 """
 
-from numpy import zeros, shape
+from numpy import dot, zeros
 
 from thunder.rdds.series import Series
 from thunder.rdds.matrices import RowMatrix
+from thunder.utils.common import treeAggregate
 
 
 class SVD(object):
@@ -18,7 +19,11 @@ class SVD(object):
         Number of singular vectors to estimate
 
     method : string, optional, default "direct"
-        Whether to use a direct or iterative method
+        Method to use, "direct" (eigendecomposition of the gramian), "tsqr" (SVD of the R factor
+        of a TSQR decomposition, which avoids squaring the condition number and so keeps small
+        singular values accurate), "randomized" (SVD of a projection onto a random subspace refined
+        by power iterations, which avoids forming the ncols x ncols gramian when k is much smaller than
+        ncols), or "em" (iterative)
 
     maxIter : int, optional, default = 20
         Maximum number of iterations if using an iterative method
@@ -26,6 +31,16 @@ class SVD(object):
     tol : float, optional, default = 0.00001
         Tolerance for convergence of iterative algorithm
 
+    oversample : int, optional, default = 10
+        Number of random directions beyond k used by the randomized method
+
+    powerIters : int, optional, default = 2
+        Number of power iterations of the randomized method, improving accuracy when singular
+        values decay slowly at the cost of two passes through the data each
+
+    seed : int, optional, default = None
+        Seed of the random test matrix of the randomized method
+
     Attributes
     ----------
     `u` : RowMatrix, nrows, each of shape (k,)
@@ -36,15 +51,26 @@ class SVD(object):
 
     `v` : array, shape (k, ncols)
         Right singular vectors
+
+    `convergence` : list of floats
+        Squared change of the subspace estimate at each iteration, if using the em method
+
+    `iterTimes` : list of floats
+        Duration in seconds of each iteration, if using the em method
     """
-    def __init__(self, k=3, method="direct", maxIter=20, tol=0.00001):
+    def __init__(self, k=3, method="direct", maxIter=20, tol=0.00001, oversample=10, powerIters=2, seed=None):
         self.k = k
         self.method = method
         self.maxIter = maxIter
         self.tol = tol
+        self.oversample = oversample
+        self.powerIters = powerIters
+        self.seed = seed
         self.u = None
         self.s = None
         self.v = None
+        self.convergence = None
+        self.iterTimes = None
 
     def calc(self, mat):
         """
@@ -60,7 +86,7 @@ class SVD(object):
         self : returns an instance of self.
         """
 
-        from numpy import argsort, dot, outer, random, sqrt, sum
+        from numpy import argsort, random, sqrt, sum
         from scipy.linalg import inv, orth
         from numpy.linalg import eigh
 
@@ -88,64 +114,98 @@ class SVD(object):
             self.s = s
             self.v = v
 
-        if self.method == "em":
+        if self.method == "tsqr":
 
-            # initialize random matrix
-            c = random.rand(self.k, mat.ncols)
-            niter = 0
-            error = 100
+            # the singular values and right singular vectors of the matrix are those of R
+            from numpy.linalg import svd
+            q, r = mat.qr()
+            ur, s, v = svd(r)
+            s = s[0:self.k]
+            v = v[0:self.k]
+
+            # left singular vectors from the orthonormal factor
+            u = q.times(ur[:, 0:self.k])
 
-            # define an accumulator
-            from pyspark.accumulators import AccumulatorParam
+            self.u = u
+            self.s = s
+            self.v = v
 
-            class MatrixAccumulatorParam(AccumulatorParam):
-                def zero(self, value):
-                    return zeros(shape(value))
+        if self.method == "randomized":
 
-                def addInPlace(self, val1, val2):
-                    val1 += val2
-                    return val1
+            # random test matrix with a few more columns than requested singular vectors
+            from numpy.linalg import qr, svd
+            nproj = min(self.k + self.oversample, mat.ncols)
+            w = random.RandomState(self.seed).randn(mat.ncols, nproj)
 
-            # define an accumulator function
-            global runSum
+            # each iteration orthonormalizes the range y = a w by TSQR, as q = a w t, dropping any directions
+            # that are numerically null, then projects back, z = a' q, and orthonormalizes that on the driver,
+            # which only holds ncols x nproj matrices
+            for i in range(self.powerIters + 1):
+                _, r = mat.times(w).qr()
+                w = dot(w, _rangeBasis(r, max(mat.nrows, nproj)))
+                z = _projectBack(mat, w)
+                if i < self.powerIters:
+                    w, _ = qr(z)
 
-            def outerSumOther(x, y):
-                global runSum
-                runSum += outer(x, dot(x, y))
+            # z is the transpose of b = q' a, whose right singular vectors are those of the matrix
+            _, s, v = svd(z.T, full_matrices=False)
+            s = s[0:self.k]
+            v = v[0:self.k]
 
-            # iterative update subspace using expectation maximization
-            # e-step: x = (c'c)^-1 c' y
-            # m-step: c = y x' (xx')^-1
-            while (niter < self.maxIter) & (error > self.tol):
+            # project back into data, normalize by singular values
+            u = mat.times(v.T / s)
 
-                cOld = c
+            self.u = u
+            self.s = s
+            self.v = v
 
-                # pre compute (c'c)^-1 c'
-                cInv = dot(c.T, inv(dot(c, c.T)))
+        if self.method == "em":
 
-                # compute (xx')^-1 through a map reduce
-                xx = mat.times(cInv).gramian()
-                xxInv = inv(xx)
+            from time import time
 
-                # pre compute (c'c)^-1 c' (xx')^-1
-                preMult2 = mat.rdd.context.broadcast(dot(cInv, xxInv))
+            # initialize random matrix
+            c = random.rand(self.k, mat.ncols)
+            niter = 0
+            error = 100
+            self.convergence = list()
+            self.iterTimes = list()
 
-                # compute the new c using an accumulator
-                # direct approach: c = mat.rows().map(lambda x: outer(x, dot(x, premult2.value))).sum()
-                runSum = mat.rdd.context.accumulator(zeros((mat.ncols, self.k)), MatrixAccumulatorParam())
-                mat.rows().foreach(lambda x: outerSumOther(x, preMult2.value))
-                c = runSum.value
+            # every iteration passes through the input, so keep it in memory unless it already is
+            uncached = not mat.rdd.is_cached
+            if uncached:
+                mat.rdd.cache()
 
-                # transpose result
-                c = c.T
+            try:
+                # iterative update subspace using expectation maximization
+                # e-step: x = (c'c)^-1 c' y
+                # m-step: c = y x' (xx')^-1
+                while (niter < self.maxIter) & (error > self.tol):
 
-                error = sum(sum((c - cOld) ** 2))
-                niter += 1
+                    start = time()
+                    cOld = c
+
+                    # pre compute (c'c)^-1 c'
+                    cInv = dot(c.T, inv(dot(c, c.T)))
+
+                    # compute xx' and yx' together in a single pass
+                    xx, yx = _emProducts(mat, cInv)
+
+                    # the new c, transposed
+                    c = dot(yx, inv(xx)).T
+
+                    error = sum(sum((c - cOld) ** 2))
+                    niter += 1
+                    self.convergence.append(error)
+                    self.iterTimes.append(time() - start)
+
+                # project data into subspace spanned by columns of c
+                # use standard eigendecomposition to recover an orthonormal basis
+                c = orth(c.T)
+                cov = mat.times(c).gramian() / mat.nrows
+            finally:
+                if uncached:
+                    mat.rdd.unpersist()
 
-            # project data into subspace spanned by columns of c
-            # use standard eigendecomposition to recover an orthonormal basis
-            c = orth(c.T)
-            cov = mat.times(c).gramian() / mat.nrows
             eigw, eigv = eigh(cov)
             inds = argsort(eigw)[::-1]
             s = sqrt(eigw[inds[0:self.k]]) * sqrt(mat.nrows)
@@ -157,3 +217,89 @@ class SVD(object):
             self.v = v
 
         return self
+
+
+def _rangeBasis(r, size):
+    """
+    Returns a matrix t such that y t has orthonormal columns spanning the numerical range of a matrix y
+    with R factor r, where `size` is the largest dimension of y. Directions whose singular values fall
+    below the rank tolerance are dropped, rather than inverted as by a triangular solve with r.
+    """
+    from numpy import finfo
+    from numpy.linalg import svd
+
+    _, sr, vr = svd(r)
+    keep = sr > sr[0] * size * finfo('float64').eps
+    return vr[keep].T / sr[keep]
+
+
+def _projectBack(mat, w, depth=2):
+    """
+    Returns the product of the transpose of a RowMatrix with its product with a local matrix, a' (a w),
+    computed from chunks of stacked rows.
+    """
+    from thunder.rdds.data import _stackInBatches
+
+    ncols = mat.ncols
+    wb = mat.rdd.context.broadcast(w)
+
+    def partitionProduct(valIter):
+        total = None
+        for batch in _stackInBatches(valIter):
+            batch = batch.reshape((batch.shape[0], ncols)).astype('float64')
+            q = dot(batch, wb.value)
+            total = dot(batch.T, q) if total is None else total + dot(batch.T, q)
+        return [] if total is None else [total]
+
+    total = treeAggregate(mat.rdd.values().mapPartitions(partitionProduct), None, _sumArrays, _sumArrays, depth)
+    if total is None:
+        return zeros((ncols, w.shape[1]))
+    return total
+
+
+def _emProducts(mat, cInv, depth=2):
+    """
+    Returns the products xx' and yx' of the EM iteration, where the rows of y are the rows of a RowMatrix
+    and x = y cInv, computed from chunks of stacked rows in a single pass.
+    """
+    from thunder.rdds.data import _stackInBatches
+
+    ncols = mat.ncols
+    k = cInv.shape[1]
+    cInvb = mat.rdd.context.broadcast(cInv)
+
+    def partitionProducts(valIter):
+        xx, yx = None, None
+        for batch in _stackInBatches(valIter):
+            batch = batch.reshape((batch.shape[0], ncols)).astype('float64')
+            x = dot(batch, cInvb.value)
+            if xx is None:
+                xx, yx = dot(x.T, x), dot(batch.T, x)
+            else:
+                xx += dot(x.T, x)
+                yx += dot(batch.T, x)
+        return [] if xx is None else [(xx, yx)]
+
+    def combine(left, right):
+        if left is None:
+            return right
+        if right is None:
+            return left
+        return _sumArrays(left[0], right[0]), _sumArrays(left[1], right[1])
+
+    total = treeAggregate(mat.rdd.values().mapPartitions(partitionProducts), None, combine, combine, depth)
+    if total is None:
+        return zeros((k, k)), zeros((ncols, k))
+    return total
+
+
+def _sumArrays(left, right):
+    """
+    Returns the sum of two arrays, either of which may be None, adding in place into the first.
+    """
+    if left is None:
+        return right
+    if right is None:
+        return left
+    left += right
+    return left
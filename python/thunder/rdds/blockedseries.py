@@ -0,0 +1,294 @@
+from itertools import islice
+
+from numpy import asarray, arange, amax, amin, maximum, minimum, vstack
+
+from thunder.rdds.data import Data
+from thunder.rdds.keys import Dimensions
+
+
+class BlockedSeries(Data):
+    """
+    Distributed collection of 1d array data, stored in columnar chunks.
+
+    Holds the same records as a Series, but backed by an RDD of (keys, values) chunks rather than one
+    key-value pair per record. Within a chunk, `keys` is an integer array of shape (n, nkeys) and `values`
+    is an array of shape (n, nvalues), with the i-th row of each belonging to the same record. Storing many
+    records per chunk avoids the per-record Python objects of a Series, so that cached and shuffled data
+    are smaller and serialize as a few large arrays.
+
+    Records of the underlying RDD, as returned by e.g. first() or collect(), are whole chunks. The `nrecords`
+    attribute and count() method refer to the number of Series records across all chunks.
+
+    Parameters
+    ----------
+    rdd : RDD of (array, array) pairs
+        RDD containing the chunked series data
+
+    index : array-like or one-dimensional list
+        Values must be unique, same length as the rows of the value arrays.
+        Defaults to arange(nvalues) if not provided.
+
+    dims : Dimensions
+        Specify the dimensions of the keys (min, max, and count), can
+        avoid computation if known in advance
+
+    See also
+    --------
+    Series : one key-value pair per record
+    BlockedSeries.fromSeries : conversion from Series
+    """
+
+    _metadata = Data._metadata + ['_dims', '_index']
+
+    def __init__(self, rdd, nrecords=None, dtype=None, index=None, dims=None):
+        super(BlockedSeries, self).__init__(rdd, nrecords=nrecords, dtype=dtype)
+        self._index = index
+        if dims and not isinstance(dims, Dimensions):
+            try:
+                dims = Dimensions.fromTuple(dims)
+            except:
+                raise TypeError("BlockedSeries dims parameter must be castable to Dimensions object, got: %s"
+                                % str(dims))
+        self._dims = dims
+
+    @property
+    def _constructor(self):
+        return BlockedSeries
+
+    @property
+    def index(self):
+        if self._index is None:
+            self.populateParamsFromFirstRecord()
+        return self._index
+
+    @property
+    def nrecords(self):
+        if self._nrecords is None:
+            self.count()
+        return self._nrecords
+
+    @property
+    def dims(self):
+        if self._dims is None:
+            def chunkDims(keys):
+                return Dimensions(values=[keys.min(axis=0), keys.max(axis=0)], n=keys.shape[1])
+            self._dims = self.rdd.keys().map(chunkDims).reduce(lambda x, y: x.mergeDims(y))
+        return self._dims
+
+    def populateParamsFromFirstRecord(self):
+        """
+        Calls first() on the underlying rdd, setting dtype and index from the returned chunk.
+
+        Returns the result of calling self.rdd.first().
+        """
+        record = super(BlockedSeries, self).populateParamsFromFirstRecord()
+        if self._index is None:
+            self._index = arange(0, record[1].shape[1])
+        return record
+
+    def _resetCounts(self):
+        self._nrecords = None
+        self._dims = None
+        return self
+
+    @classmethod
+    def fromSeries(cls, series, chunkSize=None, keyDtype='int32'):
+        """
+        Convert a Series to a BlockedSeries.
+
+        The records of each partition of the Series are stacked into chunks, without a shuffle.
+        Keys are converted to rows of an integer array; non-tuple keys are treated as keys of length one.
+        Known attributes of the Series (dtype, index, dims, nrecords) are carried over without computation.
+
+        Parameters
+        ----------
+        series : Series
+            Series to convert
+
+        chunkSize : int, optional, default = None
+            Maximum number of records per chunk. If None, each partition is converted to a single chunk.
+
+        keyDtype : numpy dtype or dtype specifier, optional, default = 'int32'
+            Integer data type of the chunk key arrays
+        """
+        rdd = series.rdd.mapPartitions(lambda kvIter: _recordsToChunks(kvIter, chunkSize, keyDtype))
+        return cls(rdd).__finalize__(series)
+
+    def toSeries(self):
+        """
+        Convert to a Series with one key-value pair per record.
+
+        Keys of the returned Series are tuples of ints.
+        """
+        from thunder.rdds.series import Series
+        return Series(self.rdd.flatMap(_chunkToRecords)).__finalize__(self)
+
+    def count(self):
+        """
+        Calculates and returns the number of records across all chunks.
+
+        Updates the .nrecords metadata attribute.
+        """
+        count = self.rdd.map(lambda (k, v): k.shape[0]).sum()
+        self._nrecords = count
+        return count
+
+    def applyValues(self, func, batchFunc=None, keepDtype=False, keepIndex=False):
+        """
+        Apply arbitrary function to the values of each record, preserving the keys.
+
+        If `batchFunc` is given, it is called once per chunk on the two-dimensional value array and must
+        return an array with one row per record; otherwise `func` is called on each row.
+
+        Parameters
+        ----------
+        func : function
+            Function to apply to the values of a single record
+
+        batchFunc : function, optional, default = None
+            Function to apply to the values of a whole chunk
+
+        keepDtype : boolean
+            Whether to preserve the dtype, if false dtype will be set to none
+            under the assumption that the function might change it
+
+        keepIndex : boolean
+            Whether to preserve the index, if false index will be set to none
+            under the assumption that the function might change it
+        """
+        def applyChunk(values):
+            if batchFunc is not None:
+                out = asarray(batchFunc(values))
+            else:
+                out = asarray([func(v) for v in values])
+            if out.ndim == 1:
+                out = out.reshape((-1, 1))
+            return out
+
+        noprop = ()
+        if keepDtype is False:
+            noprop += ('_dtype',)
+        if keepIndex is False:
+            noprop += ('_index',)
+        return self._constructor(self.rdd.mapValues(applyChunk)).__finalize__(self, noPropagate=noprop)
+
+    def filter(self, func):
+        """
+        Filter records by applying a function to each (key, value) record.
+
+        Keys are passed to `func` as tuples of ints. Chunks left empty by filtering are dropped.
+        """
+        def filterChunk(chunk):
+            keys, values = chunk
+            mask = asarray([func((tuple(k), v)) for k, v in zip(keys.tolist(), values)], dtype=bool)
+            return keys[mask], values[mask]
+
+        rdd = self.rdd.map(filterChunk).filter(lambda (k, v): k.shape[0] > 0)
+        return self._constructor(rdd).__finalize__(self)._resetCounts()
+
+    def filterOnKeys(self, func):
+        """ Filter records by applying a function to keys """
+        return self.filter(lambda (k, v): func(k))
+
+    def filterOnValues(self, func):
+        """ Filter records by applying a function to values """
+        return self.filter(lambda (k, v): func(v))
+
+    def stats(self, requestedStats='all', dtype='float64', casting='safe'):
+        """
+        Return a L{StatCounter} object that captures all or some of the mean, variance, maximum, minimum,
+        and count of the values of all records in one operation.
+
+        See Data.stats().
+        """
+        from thunder.utils.statcounter import StatCounter
+
+        def partitionStats(chunks):
+            counter = StatCounter(stats=requestedStats)
+            for values in chunks:
+                counter.mergeBatch(values)
+            return [counter]
+
+        def redFunc(left_counter, right_counter):
+            return left_counter.mergeStats(right_counter)
+
+        out = self.astype(dtype, casting)
+        return out.rdd.values().mapPartitions(partitionStats).reduce(redFunc)
+
+    def sum(self, dtype='float64', casting='safe'):
+        """
+        Sum of values of all records, ignoring keys
+
+        If dtype is not None, then the values will first be cast to the requested type before the operation is
+        performed. See Data.astype() for details.
+        """
+        out = self.astype(dtype, casting)
+        return out.rdd.values().map(lambda v: v.sum(axis=0)).sum()
+
+    def max(self):
+        """ Maximum of values of all records, ignoring keys """
+        return self.rdd.values().map(lambda v: amax(v, axis=0)).reduce(maximum)
+
+    def min(self):
+        """ Minimum of values of all records, ignoring keys """
+        return self.rdd.values().map(lambda v: amin(v, axis=0)).reduce(minimum)
+
+    def collectAsArray(self, sorting=False):
+        """
+        Return all keys and values to the driver as a tuple of numpy arrays of shape
+        (nrecords, nkeys) and (nrecords, nvalues)
+
+        This will be slow for large datasets, and may exhaust the available memory on the driver.
+        """
+        if sorting:
+            return self.toSeries().collectAsArray(sorting=True)
+        chunks = self.rdd.collect()
+        return vstack([k for k, _ in chunks]), vstack([v for _, v in chunks])
+
+    def collectValuesAsArray(self, sorting=False):
+        """
+        Return the values of all records to the driver as a numpy array of shape (nrecords, nvalues)
+
+        This will be slow for large datasets, and may exhaust the available memory on the driver.
+        """
+        if sorting:
+            return self.toSeries().collectValuesAsArray(sorting=True)
+        return vstack(self.rdd.values().collect())
+
+    def collectKeysAsArray(self, sorting=False):
+        """
+        Return the keys of all records to the driver as a numpy array of shape (nrecords, nkeys)
+
+        This will be slow for large datasets, and may exhaust the available memory on the driver.
+        """
+        if sorting:
+            return self.toSeries().collectKeysAsArray(sorting=True)
+        return vstack(self.rdd.keys().collect())
+
+
+def _recordsToChunks(kvIter, chunkSize, keyDtype):
+    """
+    Stacks an iterator of Series records into (keys, values) chunks of at most chunkSize records.
+    """
+    while True:
+        records = list(islice(kvIter, chunkSize))
+        if not records:
+            break
+        n = len(records)
+        keys = asarray([k for k, _ in records], dtype=keyDtype).reshape((n, -1))
+        values = asarray([v for _, v in records])
+        del records
+        if values.dtype == object or values.ndim > 2:
+            raise ValueError("BlockedSeries values must be scalars or one-dimensional arrays of equal length")
+        values = values.reshape((n, -1))
+        yield keys, values
+        if chunkSize is None:
+            break
+
+
+def _chunkToRecords(chunk):
+    """
+    Splits a (keys, values) chunk into Series records with tuple keys.
+    """
+    keys, values = chunk
+    return zip([tuple(k) for k in keys.tolist()], values)
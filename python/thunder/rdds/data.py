@@ -18,6 +18,10 @@ class Data(object):
         The Spark Resilient Distributed Dataset wrapped by this Data object.
         Standard pyspark RDD methods on a data instance `obj` that are not already
         directly exposed by the Data object can be accessed via `obj.rdd`.
+
+        Value transformations such as applyValues() and astype() are recorded lazily, and
+        chains of them are fused into a single pass over the data when `rdd` is accessed. If an
+        object in the chain has been cached in the meantime, the pass starts from its cached data.
     """
 
     _metadata = ['_nrecords', '_dtype']
@@ -27,6 +31,29 @@ class Data(object):
         self._nrecords = nrecords
         self._dtype = dtype
 
+    @property
+    def rdd(self):
+        if self._pending:
+            rdd, steps = self._rdd, self._pending
+            # start from the closest object this one was derived from that has since been cached,
+            # applying only the transforms that followed it
+            parent, nsteps = self._lazyParent
+            while parent is not None:
+                if not parent._pending and getattr(parent._rdd, 'is_cached', False):
+                    rdd, steps = parent._rdd, steps[nsteps:]
+                    break
+                parent, nsteps = parent._lazyParent
+            self._rdd = self._fusePending(rdd, steps) if steps else rdd
+            self._pending = ()
+            self._lazyParent = (None, 0)
+        return self._rdd
+
+    @rdd.setter
+    def rdd(self, value):
+        self._rdd = value
+        self._pending = ()
+        self._lazyParent = (None, 0)
+
     def __repr__(self):
         # start with class name
         s = self.__class__.__name__
@@ -106,6 +133,55 @@ class Data(object):
     def _constructor(self):
         return Data
 
+    def _applyValuesLazily(self, func, batchFunc=None, constructor=None, noPropagate=(), **kwargs):
+        """
+        Returns a new Data object with `func` applied to each value, without creating a new RDD.
+
+        The function is recorded as a pending transform on the returned object, on top of any transforms
+        still pending on this one. All pending transforms are fused into a single mapPartitions pass when
+        the `rdd` attribute of the returned object is first accessed.
+
+        Parameters
+        ----------
+        func : function
+            Function to apply to each value
+
+        batchFunc : function, optional, default = None
+            Equivalent of func operating on many values stacked into a two-dimensional array, one per row.
+            Used by Series objects with vectorized execution enabled; see Series.vectorize.
+
+        constructor : class, optional, default = None
+            Class of the returned object, defaults to self._constructor
+
+        noPropagate : iterable of string attribute names, default empty tuple
+            Attributes that will not be propagated from this object; see __finalize__
+
+        kwargs : keyword arguments passed on to the constructor of the returned object
+        """
+        if constructor is None:
+            constructor = self._constructor
+        new = constructor(self._rdd, **kwargs)
+        new._pending = self._pending + ((func, batchFunc),)
+        if self._pending:
+            # remember where this object's own transforms start, in case this one is cached later
+            new._lazyParent = (self, len(self._pending))
+        return new.__finalize__(self, noPropagate=noPropagate)
+
+    def _fusePending(self, rdd, steps):
+        """
+        Returns an RDD applying each function in `steps`, a sequence of (func, batchFunc) pairs,
+        in order to the values of `rdd`, in a single pass.
+        """
+        funcs = [func for func, _ in steps]
+
+        def applySteps(kvIter):
+            for k, v in kvIter:
+                for func in funcs:
+                    v = func(v)
+                yield k, v
+
+        return rdd.mapPartitions(applySteps, preservesPartitioning=True)
+
     def _resetCounts(self):
         self._nrecords = None
         return self
@@ -159,7 +235,7 @@ class Data(object):
         """
         firstKey = self.first()[0]
         Data.__getKeyTypeCheck(firstKey, key)
-        filteredVals = self.rdd.filter(lambda (k, v): k == key).values().collect()
+        filteredVals = [v for _, v in self._filterPartitions(lambda (k, v): k == key, self._partitionsOf([key]))]
         if len(filteredVals) == 1:
             return filteredVals[0]
         elif not filteredVals:
@@ -180,7 +256,7 @@ class Data(object):
         for key in keys:
             Data.__getKeyTypeCheck(firstKey, key)
         keySet = frozenset(keys)
-        filteredRecs = self.rdd.filter(lambda (k, _): k in keySet).collect()
+        filteredRecs = self._filterPartitions(lambda (k, _): k in keySet, self._partitionsOf(keys))
         sortingDict = {}
         for k, v in filteredRecs:
             sortingDict.setdefault(k, []).append(v)
@@ -253,10 +329,36 @@ class Data(object):
                     raise ValueError("'step' slice attribute is not supported in getRange, got step: %d" %
                                      slise.step)
 
-        filteredRecs = self.rdd.filter(pFunc).collect()
+        filteredRecs = self._filterPartitions(pFunc, self._partitionsOfRange(sliceOrSlices))
         # default sort of tuples is by first item, which happens to be what we want
         return sorted(filteredRecs)
 
+    def _partitionsOf(self, keys):
+        """
+        Returns a list of the ids of the partitions that can hold records with the passed keys,
+        or None if any partition can. Overridden by subclasses that know how their records are partitioned.
+        """
+        return None
+
+    def _partitionsOfRange(self, sliceOrSlices):
+        """
+        Returns a list of the ids of the partitions that can hold records with keys in the passed range
+        (see getRange), or None if any partition can.
+        """
+        return None
+
+    def _filterPartitions(self, func, partitions=None):
+        """
+        Returns a list of the records for which `func` is true, only searching the partitions with the passed
+        ids if `partitions` is not None.
+        """
+        if partitions is None:
+            return self.rdd.filter(func).collect()
+        if not partitions:
+            return []
+        return self.rdd.context.runJob(self.rdd, lambda kvIter: [kv for kv in kvIter if func(kv)],
+                                       partitions=list(partitions))
+
     def __getitem__(self, item):
         # should raise exception here when no matching items found
         # see object.__getitem__ in https://docs.python.org/2/reference/datamodel.html
@@ -328,8 +430,8 @@ class Data(object):
                 # turn ourself into a numpy scalar of the appropriate type
                 return asarray([v]).astype(dtype_, casting=casting_, copy=False)[0]
 
-        nextRdd = self.rdd.mapValues(lambda v: cast(v, dtypeFunc(dtype), casting))
-        return self._constructor(nextRdd, dtype=str(dtype)).__finalize__(self)
+        castFunc = lambda v: cast(v, dtypeFunc(dtype), casting)
+        return self._applyValuesLazily(castFunc, castFunc, dtype=str(dtype))
 
     def apply(self, func, keepDtype=False, keepIndex=False):
         """
@@ -369,15 +471,23 @@ class Data(object):
 
         return self.apply(lambda (k, v): (func(k), v), **kwargs)
 
-    def applyValues(self, func, **kwargs):
+    def applyValues(self, func, keepDtype=False, keepIndex=False):
         """
         Apply arbitrary function to the values of a Data object, preserving the keys.
 
+        The function is not applied immediately, but fused with any other pending value transforms
+        into a single pass over the data; see Data.rdd.
+
         See also
         --------
         Series.apply
         """
-        return self.apply(lambda (k, v): (k, func(v)), **kwargs)
+        noprop = ()
+        if keepDtype is False:
+            noprop += ('_dtype',)
+        if keepIndex is False:
+            noprop += ('_index',)
+        return self._applyValuesLazily(func, noPropagate=noprop)
 
     def collect(self, sorting=False):
         """
@@ -510,11 +620,69 @@ class Data(object):
         """
         from thunder.utils.statcounter import StatCounter
 
+        if dtype == '':
+            dtype = None
+        elif dtype == 'smallfloat':
+            from thunder.utils.common import smallestFloatType
+            dtype = smallestFloatType(self.dtype)
+
+        def partitionStats(valIter):
+            # values are stacked into arrays and merged a batch at a time, rather than record by record
+            counter = StatCounter(stats=requestedStats)
+            for batch in _stackInBatches(valIter):
+                if dtype is not None:
+                    batch = batch.astype(dtype, casting=casting, copy=False)
+                counter.mergeBatch(batch)
+            return [counter]
+
         def redFunc(left_counter, right_counter):
             return left_counter.mergeStats(right_counter)
 
-        out = self.astype(dtype, casting)
-        return out.values().mapPartitions(lambda i: [StatCounter(i, stats=requestedStats)]).reduce(redFunc)
+        return self.values().mapPartitions(partitionStats).reduce(redFunc)
+
+    def quantiles(self, qs, axis=0, k=256):
+        """
+        Approximate quantiles of values, ignoring keys, computed in a single pass.
+
+        Each partition summarizes its values in a QuantileSketch of bounded size, and the sketches
+        are merged on the way to the driver, so that no values are collected. Quantiles have a rank
+        error of about log2(n / k) / k of the number n of values summarized.
+
+        Parameters
+        ----------
+        qs : float or sequence of floats
+            Quantiles to compute, between 0 and 1
+
+        axis : 0 or None, optional, default = 0
+            If 0, quantiles are computed across records separately for each position in the values,
+            e.g. for each time point of a Series or each pixel of Images. If None, they are computed
+            across all elements of all values
+
+        k : int, optional, default = 256
+            Size parameter of the sketches, trading accuracy for memory, see QuantileSketch
+
+        Returns
+        -------
+        Array of the shape of a value (or a scalar if axis is None) for a single quantile, otherwise
+        with an additional first axis along the requested quantiles
+        """
+        from thunder.utils.quantilesketch import QuantileSketch
+
+        if axis not in (0, None):
+            raise ValueError("axis must be 0 or None, got %s" % str(axis))
+
+        def partitionSketch(valIter):
+            sketch = QuantileSketch(k=k)
+            for batch in _stackInBatches(valIter):
+                if axis is None:
+                    batch = batch.reshape(-1)
+                sketch.mergeBatch(batch)
+            return [sketch]
+
+        def redFunc(left, right):
+            return left.mergeSketch(right)
+
+        return self.values().mapPartitions(partitionSketch).reduce(redFunc).quantiles(qs)
 
     def max(self):
         """ Maximum of values, ignoring keys """
@@ -548,7 +716,8 @@ class Data(object):
         """
         Enable in-memory caching.
 
-        This calls the Spark cache() method on the underlying RDD.
+        This calls the Spark cache() method on the underlying RDD. Objects already derived from this one
+        by pending value transforms will also start from the cached data; see Data.rdd.
         """
         self.rdd.cache()
         return self
@@ -577,8 +746,30 @@ class Data(object):
 
     def filterOnKeys(self, func):
         """ Filter records by applying a function to keys """
-        return self._constructor(self.rdd.filter(lambda (k, v): func(k))).__finalize__(self)._resetCounts()
+        return self.filter(lambda (k, v): func(k))
 
     def filterOnValues(self, func):
         """ Filter records by applying a function to values """
-        return self._constructor(self.rdd.filter(lambda (k, v): func(v))).__finalize__(self)._resetCounts()
+        return self.filter(lambda (k, v): func(v))
+
+
+def _stackInBatches(valIter, maxBytes=64*1024*1024):
+    """
+    Stacks the values produced by an iterator into arrays of up to roughly maxBytes, one value per row.
+
+    A new array is started whenever a value's shape differs from that of the previous value.
+    """
+    batch = []
+    batchBytes = 0
+    shape = None
+    for v in valIter:
+        v = asarray(v)
+        if batch and (v.shape != shape or batchBytes >= maxBytes):
+            yield asarray(batch)
+            batch = []
+            batchBytes = 0
+        shape = v.shape
+        batch.append(v)
+        batchBytes += v.nbytes
+    if batch:
+        yield asarray(batch)
@@ -76,7 +76,8 @@ class SeriesLoader(object):
 
         dims = Dimensions.fromTuple(shape[::-1])
 
-        return Series(self.sc.parallelize(zip(keys, values), self.minPartitions), dims=dims, dtype=str(dtype))
+        return Series(self.sc.parallelize(zip(keys, values), self.minPartitions), dims=dims, dtype=str(dtype),
+                      index=arange(len(arrays)))
 
     @staticmethod
     def __normalizeDatafilePattern(dataPath, ext):
@@ -125,7 +126,9 @@ class SeriesLoader(object):
 
         lines = self.sc.textFile(dataPath, self.minPartitions)
         data = lines.map(lambda x: parse(x, nkeys))
-        return Series(data, dtype=str(dtype))
+        series = Series(data, dtype=str(dtype))
+        series._nkeys = nkeys
+        return series
 
     # keytype, valuetype here violate camelCasing convention for consistence with JSON conf file format
     BinaryLoadParameters = namedtuple('BinaryLoadParameters', 'nkeys nvalues keytype valuetype')
@@ -215,7 +218,9 @@ class SeriesLoader(object):
                          (tuple(int(x) for x in frombuffer(buffer(v, 0, keySize), dtype=keyDtype)),
                           frombuffer(buffer(v, keySize), dtype=valDtype)))
 
-        return Series(data, dtype=str(valDtype), index=arange(paramsObj.nvalues)).astype(newDtype, casting)
+        series = Series(data, dtype=str(valDtype), index=arange(paramsObj.nvalues))
+        series._nkeys = paramsObj.nkeys
+        return series.astype(newDtype, casting)
 
     def _getSeriesBlocksFromStack(self, dataPath, dims, ext="stack", blockSize="150M", dtype='int16',
                                   newDtype='smallfloat', casting='safe', startIdx=None, stopIdx=None, recursive=False):
@@ -731,7 +736,8 @@ class SeriesLoader(object):
         else:
             keys = arange(0, data.shape[0])
 
-        rdd = Series(self.sc.parallelize(zip(keys, data), self.minPartitions), dtype=str(data.dtype))
+        rdd = Series(self.sc.parallelize(zip(keys, data), self.minPartitions), dtype=str(data.dtype),
+                     index=arange(data.shape[1]) if data.ndim == 2 else None)
 
         return rdd
 
@@ -748,7 +754,8 @@ class SeriesLoader(object):
         else:
             keys = arange(0, data.shape[0])
 
-        rdd = Series(self.sc.parallelize(zip(keys, data), self.minPartitions), dtype=str(data.dtype))
+        rdd = Series(self.sc.parallelize(zip(keys, data), self.minPartitions), dtype=str(data.dtype),
+                     index=arange(data.shape[1]) if data.ndim == 2 else None)
 
         return rdd
 
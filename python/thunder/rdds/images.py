@@ -412,6 +412,53 @@ class Images(Data):
 
         return self._constructor(newrdd, dims=newdims).__finalize__(self)
 
+    def gramian(self):
+        """
+        Compute the gramian of the images, the matrix of dot products between every pair of images
+        taken as vectors of pixels, without converting to Series.
+
+        The images of each partition are stacked into a block, with one flattened image per row. Dot products
+        between images in the same partition come from the gramian of the block, and those between images
+        in different partitions from the product of each pair of blocks, so that only the blocks, and never
+        single pixels, are exchanged between partitions.
+
+        Returns
+        -------
+        keys : list
+            Sorted keys of the images
+
+        gram : array, shape (nrecords, nrecords)
+            Dot products between images, with rows and columns in the order of the sorted keys
+        """
+        from numpy import asarray, dot, ix_, zeros
+
+        def toBlock(idx, kvIter):
+            records = list(kvIter)
+            if not records:
+                return []
+            values = asarray([v.ravel() for _, v in records], dtype='float64')
+            return [(idx, [k for k, _ in records], values)]
+
+        def blockProduct((left, right)):
+            leftIdx, leftKeys, leftValues = left
+            rightIdx, rightKeys, rightValues = right
+            return leftKeys, rightKeys, dot(leftValues, rightValues.T)
+
+        blocks = self.rdd.mapPartitionsWithIndex(toBlock).cache()
+        products = blocks.cartesian(blocks).filter(lambda (left, right): left[0] <= right[0])\
+            .map(blockProduct).collect()
+        blocks.unpersist()
+
+        keys = sorted(set(k for rowKeys, colKeys, _ in products for k in rowKeys + colKeys))
+        position = dict((k, i) for i, k in enumerate(keys))
+        gram = zeros((len(keys), len(keys)))
+        for rowKeys, colKeys, product in products:
+            rows = [position[k] for k in rowKeys]
+            cols = [position[k] for k in colKeys]
+            gram[ix_(rows, cols)] = product
+            gram[ix_(cols, rows)] = product.T
+        return keys, gram
+
     def meanByRegions(self, selection):
         """
         Reduces images to one or more spatially averaged values using the given selection, which can be
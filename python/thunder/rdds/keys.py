@@ -1,6 +1,6 @@
 """Helper functions and classes for working with keys"""
 
-from numpy import mod, ceil, cumprod, append, size, inf, subtract
+from numpy import mod, ceil, cumprod, append, size, inf, subtract, prod
 
 
 class Dimensions(object):
@@ -50,6 +50,105 @@ class Dimensions(object):
         return self.count[item]
 
 
+class _KeyRangeIndex(object):
+    """
+    Assigns keys within known dimensions to partitions by contiguous ranges of their linear index.
+
+    Keys are linearized with the first key changing fastest, relative to the minimum of the dimensions,
+    and the range of linear indices is split evenly into `npartitions` parts. Partitioning by the
+    partitionOf() method of an instance therefore places records in key order across partitions,
+    without needing to sample the keys.
+
+    Keys outside of the dimensions (for instance when the keys were changed after the dimensions
+    were found) are placed by comparing their reversed tuples with the first key of each range, so
+    that every key is assigned a partition consistent with the order of Data.sortByKey.
+    """
+
+    def __init__(self, dims, npartitions):
+        self.min = tuple(dims.min)
+        self.count = tuple(dims.count)
+        self.size = int(prod(self.count))
+        self.npartitions = npartitions
+        self._converter = _subToIndConverter(self.count, order='F', isOneBased=False)
+        self._bounds = None
+
+    def linearIndex(self, key):
+        """ Linear index of the passed key, or None if it falls outside of the dimensions """
+        if not hasattr(key, '__len__'):
+            key = (key,)
+        if len(key) != len(self.min):
+            return None
+        sub = tuple([k - mn for k, mn in zip(key, self.min)])
+        if any([s < 0 or s >= n for s, n in zip(sub, self.count)]):
+            return None
+        return self._converter(sub)
+
+    def containsAll(self, keys):
+        """ Whether all of a sequence of keys fall within the dimensions """
+        from numpy import asarray
+        subs = asarray(keys)
+        if subs.dtype == object or subs.reshape((len(keys), -1)).shape[1] != len(self.min):
+            return False
+        subs = subs.reshape((len(keys), -1)) - asarray(self.min)
+        return bool(((subs >= 0) & (subs < asarray(self.count))).all())
+
+    def linearIndices(self, keys):
+        """ Array of the linear indices of a sequence of keys, all of which must fall within the dimensions """
+        from numpy import asarray, ravel_multi_index
+        subs = asarray(keys).reshape((len(keys), -1)) - asarray(self.min)
+        return ravel_multi_index(tuple(subs.T), self.count, order='F')
+
+    def partitionOfIndex(self, ind):
+        """ Partition holding the passed linear index """
+        return int(ind * self.npartitions // self.size)
+
+    def bounds(self):
+        """ Reversed first key of each partition after the first, in increasing order """
+        if self._bounds is None:
+            from numpy import unravel_index
+            firsts = [-(-i * self.size // self.npartitions) for i in xrange(1, self.npartitions)]
+            self._bounds = [tuple([int(s) + mn for s, mn in zip(unravel_index(ind, self.count, order='F'),
+                                                                self.min)])[::-1] for ind in firsts]
+        return self._bounds
+
+    def partitionOf(self, key):
+        """ Partition that can hold the passed key """
+        from bisect import bisect_right
+        ind = self.linearIndex(key)
+        if ind is not None:
+            return self.partitionOfIndex(ind)
+        if not hasattr(key, '__len__'):
+            key = (key,)
+        return bisect_right(self.bounds(), tuple(key)[::-1])
+
+    def partitionsOf(self, keys):
+        """ Sorted list of the partitions that can hold any of the passed keys """
+        return sorted(set([self.partitionOf(key) for key in keys]))
+
+    def partitionsOfRange(self, sliceOrSlices):
+        """
+        Sorted list of the partitions that can hold keys within the passed slice or sequence of slices
+        (or single values), as in Data.getRange.
+        """
+        if not hasattr(sliceOrSlices, '__iter__'):
+            sliceOrSlices = [sliceOrSlices]
+        if len(sliceOrSlices) != len(self.min):
+            return range(self.npartitions)
+        lower, upper = [], []
+        for slise in sliceOrSlices:
+            if isinstance(slise, slice):
+                start = -inf if slise.start is None else slise.start
+                stop = inf if slise.stop is None else slise.stop
+            else:
+                start, stop = slise, slise + 1
+            if stop <= start:
+                return []
+            lower.append(start)
+            upper.append(stop - 1)
+        # keys are ordered by their reversed tuples, so all keys in the range lie between its corners
+        return range(self.partitionOf(tuple(lower)), self.partitionOf(tuple(upper)) + 1)
+
+
 def _indToSubConverter(dims, order='F', isOneBased=True):
     """
     Converter for changing linear indexing to subscript indexing
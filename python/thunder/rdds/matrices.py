@@ -5,6 +5,7 @@ Class with utilities for representing and working with matrices
 from numpy import dot, outer, shape, ndarray, add, subtract, multiply, zeros, divide, arange
 
 from thunder.rdds.series import Series
+from thunder.utils.common import treeAggregate
 
 
 # TODO: right divide and left divide
@@ -93,7 +94,7 @@ class RowMatrix(Series):
         else:
             return self.center(axis).gramian() / self.nrows
 
-    def gramian(self, method="accum"):
+    def gramian(self, method="stacked", depth=2, packed=False):
         """
         Compute gramian of a distributed matrix.
 
@@ -101,9 +102,44 @@ class RowMatrix(Series):
 
         Parameters
         ----------
-        method : string, optional, default = "reduce"
-            Method to use for summation
+        method : string, optional, default = "stacked"
+            Method to use for summation. "stacked" stacks the rows of each partition into
+            chunks, computes the gramian of each chunk with a single symmetric rank-k update (BLAS syrk),
+            and sums the partition results in a tree of the given depth. "reduce", "accum", and
+            "aggregate" sum the outer products of individual rows.
+
+        depth : int, optional, default = 2
+            Depth of the tree in which partition results are summed, for method "stacked" only
+
+        packed : boolean, optional, default = False
+            Whether partition results are summed as packed upper triangles, halving the data sent
+            to the driver, for method "stacked" only
         """
+        if method == "stacked":
+            from numpy import triu_indices
+
+            ncols = self.ncols
+            upper = triu_indices(ncols)
+
+            def combine(left, right):
+                if left is None:
+                    return right
+                if right is None:
+                    return left
+                left += right
+                return left
+
+            partitions = self.rdd.values().mapPartitions(lambda valIter: _partitionGramian(valIter, ncols, packed))
+            total = treeAggregate(partitions, None, combine, combine, depth)
+            if total is None:
+                return zeros((ncols, ncols))
+            if packed:
+                unpacked = zeros((ncols, ncols))
+                unpacked[upper] = total
+                total = unpacked
+            # only the upper triangle has been accumulated
+            total.T[upper] = total[upper]
+            return total
 
         from pyspark.accumulators import AccumulatorParam
 
@@ -115,10 +151,10 @@ class RowMatrix(Series):
                 val1 += val2
                 return val1
 
-        if method is "reduce":
+        if method == "reduce":
             return self.rdd.map(lambda (k, v): v).mapPartitions(matrixSumIterator_self).sum()
 
-        if method is "accum":
+        if method == "accum":
             global mat
             mat = self.rdd.context.accumulator(zeros((self.ncols, self.ncols)), MatrixAccumulatorParam())
 
@@ -129,7 +165,7 @@ class RowMatrix(Series):
 
             return mat.value
 
-        if method is "aggregate":
+        if method == "aggregate":
 
             def seqOp(x, v):
                 return x + outer(v, v)
@@ -141,7 +177,47 @@ class RowMatrix(Series):
             return self.rdd.map(lambda (_, v): v).aggregate(zeros((self.ncols, self.ncols)), seqOp, combOp)
 
         else:
-            raise Exception("method must be reduce, accum, or aggregate")
+            raise Exception("method must be stacked, reduce, accum, or aggregate")
+
+    def qr(self, depth=2):
+        """
+        Compute the QR decomposition of a tall and skinny distributed matrix by TSQR.
+
+        Each partition computes the R factor of its rows, merging in one chunk of stacked rows at a time,
+        and the R factors of the partitions are merged pairwise in a tree of the given depth, by computing
+        the R factor of each stacked pair. Only the small R factors are communicated, and the result is
+        as numerically stable as a Householder QR of the whole matrix.
+
+        Q is not computed until used: it is defined as the product of the matrix with the inverse of R,
+        applied to each row by a triangular solve. It is therefore only accurate if the matrix has full
+        column rank, so that R is well conditioned.
+
+        Parameters
+        ----------
+        depth : int, optional, default = 2
+            Depth of the tree in which partition R factors are merged
+
+        Returns
+        -------
+        q : RowMatrix, nrows, each of shape (ncols,)
+            Orthonormal factor
+
+        r : array, shape (ncols, ncols)
+            Upper-triangular factor
+        """
+        from scipy.linalg import solve_triangular
+
+        ncols = self.ncols
+        r = treeAggregate(self.rdd.values().mapPartitions(lambda valIter: _partitionR(valIter, ncols)),
+                          None, _mergeR, _mergeR, depth)
+        if r is None or r.shape[0] < ncols:
+            raise ValueError("QR requires at least as many rows as columns, got %d columns" % ncols)
+
+        # rows of Q are the solutions x of x r = row, i.e. r' x' = row'
+        q = self._applyValuesLazily(lambda x: solve_triangular(r, x, trans='T'),
+                                    lambda x: solve_triangular(r, x.T, trans='T').T,
+                                    dtype='float64', index=arange(ncols))
+        return q, r
 
     def times(self, other):
         """
@@ -261,6 +337,55 @@ class RowMatrix(Series):
         return RowMatrix.elementwise(self, other, divide)
 
 
+def _partitionR(valIter, ncols):
+    """
+    Returns a list with the R factor of the QR decomposition of the rows produced by an iterator,
+    merging in one chunk of stacked rows at a time, or an empty list if there are no rows.
+    """
+    from numpy import vstack
+    from numpy.linalg import qr
+
+    from thunder.rdds.data import _stackInBatches
+
+    r = None
+    for batch in _stackInBatches(valIter):
+        batch = batch.reshape((batch.shape[0], ncols)).astype('float64')
+        r = qr(batch if r is None else vstack((r, batch)), mode='r')
+    return [] if r is None else [r]
+
+
+def _mergeR(left, right):
+    """
+    Returns the R factor of the QR decomposition of two stacked R factors, either of which may be None.
+    """
+    from numpy import vstack
+    from numpy.linalg import qr
+
+    if left is None:
+        return right
+    if right is None:
+        return left
+    return qr(vstack((left, right)), mode='r')
+
+
+def _partitionGramian(valIter, ncols, packed=False):
+    """
+    Returns a list with the upper triangle of the gramian of the rows produced by an iterator, computed by a
+    symmetric rank-k update with each chunk of stacked rows, as a full matrix or as a packed array if `packed`.
+    """
+    from numpy import asfortranarray, triu_indices
+    from scipy.linalg.blas import dsyrk
+
+    from thunder.rdds.data import _stackInBatches
+
+    gram = zeros((ncols, ncols), order='F')
+    for batch in _stackInBatches(valIter):
+        gram = dsyrk(1.0, asfortranarray(batch, dtype='float64'), c=gram, beta=1.0, trans=1, overwrite_c=1)
+    if packed:
+        return [gram[triu_indices(ncols)]]
+    return [gram]
+
+
 def matrixSumIterator_self(iterator):
     yield sum(outer(x, x) for x in iterator)
 
@@ -1,9 +1,9 @@
 from numpy import ndarray, array, sum, mean, median, std, size, arange, percentile,\
-    asarray, maximum, minimum, zeros, corrcoef, where, true_divide, ceil
+    asarray, maximum, minimum, zeros, corrcoef, where, true_divide, ceil, amax, amin, newaxis, column_stack
 
 from thunder.rdds.data import Data
 from thunder.rdds.keys import Dimensions
-from thunder.utils.common import loadMatVar
+from thunder.utils.common import loadMatVar, toLocalIterator, treeAggregate
 
 
 class Series(Data):
@@ -36,21 +36,25 @@ class Series(Data):
     --------
     TimeSeries : a Series where the indices represent time
     SpatialSeries : a Series where the keys represent spatial coordinates
+    Series.vectorize : enable partition-blocked execution of Series methods
     """
 
-    _metadata = Data._metadata + ['_dims', '_index']
+    _metadata = Data._metadata + ['_dims', '_index', '_nkeys']
 
     def __init__(self, rdd, nrecords=None, dtype=None, index=None, dims=None):
         super(Series, self).__init__(rdd, nrecords=nrecords, dtype=dtype)
+        self._vectorized = False
+        self._keyIndex = None
         self._index = None
         if index is not None:
-            self.index = index
+            self._index = self._normalizeIndex(index)
         if dims and not isinstance(dims, Dimensions):
             try:
                 dims = Dimensions.fromTuple(dims)
             except:
                 raise TypeError("Series dims parameter must be castable to Dimensions object, got: %s" % str(dims))
         self._dims = dims
+        self._nkeys = len(dims) if dims else None
 
     @property
     def index(self):
@@ -62,13 +66,7 @@ class Series(Data):
     def index(self, value):
         # touches self.index to trigger automatic calculation from first record if self.index is not set
         lenSelf = len(self.index)
-        if type(value) is str:
-            value = [value]
-        # if new index is not indexable, assume that it is meant as an index of length 1
-        try:
-            value[0]
-        except:
-            value = [value]
+        value = self._normalizeIndex(value)
         try:
             lenValue = len(value)
         except:
@@ -77,14 +75,21 @@ class Series(Data):
             raise ValueError("Length of new index ({0}) must match length of original index ({1})".format(lenValue, lenSelf))
         self._index = value
 
+    @staticmethod
+    def _normalizeIndex(value):
+        if type(value) is str:
+            value = [value]
+        # if new index is not indexable, assume that it is meant as an index of length 1
+        try:
+            value[0]
+        except:
+            value = [value]
+        return value
+
     @property
     def dims(self):
-        from thunder.rdds.keys import Dimensions
         if self._dims is None:
-            entry = self.populateParamsFromFirstRecord()[0]
-            n = size(entry)
-            d = self.rdd.keys().mapPartitions(lambda i: [Dimensions(i, n)]).reduce(lambda x, y: x.mergeDims(y))
-            self._dims = d
+            self._dims = self.rdd.keys().mapPartitions(_partitionDims).reduce(lambda x, y: x.mergeDims(y))
         return self._dims
 
     @property
@@ -100,6 +105,8 @@ class Series(Data):
         Returns the result of calling self.rdd.first().
         """
         record = super(Series, self).populateParamsFromFirstRecord()
+        if self._nkeys is None:
+            self._nkeys = size(record[0])
         if self._index is None:
             val = record[1]
             try:
@@ -114,6 +121,165 @@ class Series(Data):
     def _constructor(self):
         return Series
 
+    def __finalize__(self, other, noPropagate=()):
+        super(Series, self).__finalize__(other, noPropagate=noPropagate)
+        if getattr(other, '_vectorized', False):
+            self._vectorized = True
+        return self
+
+    def vectorize(self, enabled=True):
+        """
+        Enable or disable partition-blocked ("vectorized") execution of Series methods.
+
+        When enabled, methods such as center(), zscore(), seriesStat(), and correlate(), as well as
+        the TimeSeries methods fourier(), crossCorr(), normalize(), and detrend(), stack all records
+        in each partition into a single two-dimensional array of shape (number of records, length of index)
+        and compute their results with one vectorized numpy call per partition, rather than one call
+        per record. Results match those of the per-record path to floating-point precision.
+
+        Each partition must fit into memory as a single array on the workers while vectorized execution
+        is enabled. Objects derived from this one will inherit the setting.
+
+        Parameters
+        ----------
+        enabled : boolean, optional, default = True
+            Whether to use vectorized execution
+
+        Returns
+        -------
+        self, for chaining
+        """
+        self._vectorized = enabled
+        return self
+
+    def _applyValuesLazily(self, func, batchFunc=None, constructor=None, noPropagate=(), **kwargs):
+        new = super(Series, self)._applyValuesLazily(func, batchFunc, constructor=constructor,
+                                                     noPropagate=noPropagate, **kwargs)
+        # value transforms preserve both keys and partitioning
+        new._keyIndex = self._keyIndex
+        return new
+
+    def apply(self, func, keepDtype=False, keepIndex=False):
+        """
+        Apply arbitrary function to records of a Series.
+
+        The function may change the keys, so the number of keys is found again from the data when needed.
+
+        See also
+        --------
+        Data.apply
+        """
+        new = super(Series, self).apply(func, keepDtype=keepDtype, keepIndex=keepIndex)
+        new._nkeys = None
+        return new
+
+    def _fusePending(self, rdd, steps):
+        """
+        Returns an RDD applying each function in `steps` in order to the values of `rdd`, in a single pass.
+
+        If vectorized execution is enabled, the records of each partition are stacked once into a
+        two-dimensional array, and each step is applied with its batch function where one is available.
+        Steps without a batch function, or whose batch function does not return one row per record, fall
+        back to record-by-record application; later steps are stacked again if possible.
+
+        See also
+        --------
+        Series.vectorize
+        """
+        if not self._vectorized:
+            return super(Series, self)._fusePending(rdd, steps)
+        return rdd.mapPartitions(lambda kvIter: _applyToStackedPartition(kvIter, steps), preservesPartitioning=True)
+
+    def applyValues(self, func, keepDtype=False, keepIndex=False, inferMetadata=False):
+        """
+        Apply arbitrary function to the values of a Series, preserving the keys.
+
+        The function is not applied immediately, but fused with any other pending value transforms
+        into a single pass over the data; see Data.rdd.
+
+        Parameters
+        ----------
+        func : function
+            Function to apply to the values of each record
+
+        keepDtype : boolean, optional, default = False
+            Whether to preserve the dtype, if false dtype will be set to none
+            under the assumption that the function might change it
+
+        keepIndex : boolean, optional, default = False
+            Whether to preserve the index, if false index will be set to none
+            under the assumption that the function might change it
+
+        inferMetadata : boolean, optional, default = False
+            Whether to infer a dtype and index that are not kept by applying `func` on the driver to a
+            record of ones, avoiding a job to find them later. Only suitable for cheap functions without
+            side effects whose output length does not depend on the values
+
+        See also
+        --------
+        Data.applyValues
+        """
+        out = super(Series, self).applyValues(func, keepDtype=keepDtype, keepIndex=keepIndex)
+        if inferMetadata:
+            for name, value in self._inferMetadata(func, keepDtype, keepIndex).items():
+                setattr(out, '_' + name, value)
+        return out
+
+    def _applyValuesBatched(self, func, batchFunc=None, keepDtype=False, keepIndex=False):
+        """
+        Equivalent to applyValues(func), but using `batchFunc` on stacked partitions if vectorized.
+
+        `batchFunc` is called on a two-dimensional array holding one record per row, and must return an
+        array with one result (row or scalar) per record. If `batchFunc` is None, `func` is expected to
+        operate along the last axis of its input and is used in both cases.
+
+        See also
+        --------
+        Series.vectorize
+        """
+        if batchFunc is None:
+            batchFunc = func
+        noprop = ()
+        if keepDtype is False:
+            noprop += ('_dtype',)
+        if keepIndex is False:
+            noprop += ('_index',)
+        return self._applyValuesLazily(func, batchFunc, noPropagate=noprop,
+                                       **self._inferMetadata(func, keepDtype, keepIndex))
+
+    def _inferMetadata(self, func, keepDtype=False, keepIndex=False):
+        """
+        Returns a dict of the dtype and index (unless kept) of the result of applying `func` to the values
+        of this Series, as constructor keyword arguments.
+
+        These are determined by applying `func` to a local array of ones matching this Series' index and
+        dtype, so that no job is needed. The dict will be empty if this is not possible.
+        """
+        import warnings
+        from numpy import ones, errstate
+
+        if not self._dtype or self._index is None or (keepDtype and keepIndex):
+            return {}
+        try:
+            with warnings.catch_warnings(), errstate(all='ignore'):
+                warnings.simplefilter('ignore')
+                out = asarray(func(ones(len(self._index), dtype=self._dtype)))
+        except Exception:
+            return {}
+        metadata = {}
+        if not keepDtype:
+            metadata['dtype'] = str(out.dtype)
+        if not keepIndex:
+            metadata['index'] = arange(0, len(out) if out.ndim > 0 else 1)
+        return metadata
+
+    def _inferDtype(self, func):
+        """
+        Returns the dtype of the result of applying `func` to the values of this Series, or None if this
+        cannot be determined without inspecting the data; see Series._inferMetadata.
+        """
+        return self._inferMetadata(func, keepIndex=True).get('dtype')
+
     @staticmethod
     def _checkType(record):
         key = record[0]
@@ -130,6 +296,77 @@ class Series(Data):
         self._dims = None
         return self
 
+    def filter(self, func):
+        """
+        Filter records by applying a function to each record.
+
+        This calls the Spark filter() method on the underlying RDD.
+        """
+        out = super(Series, self).filter(func)
+        out._keyIndex = self._keyIndex
+        return out
+
+    def indexByKey(self, npartitions=None):
+        """
+        Partition records by ranges of their keys, to speed up lookups by key.
+
+        Keys are linearized within the dimensions of this Series (with the first key changing fastest), and
+        records are partitioned into contiguous ranges of linear indices. The boundaries of these ranges
+        are kept on the driver, so that get(), getMany(), getRange() and indexing into the returned Series
+        only search the partitions that can hold the requested keys, rather than the whole data set.
+
+        Value transformations and filtering of the returned Series keep the partitioning, so that their
+        results can also be looked up quickly.
+
+        Parameters
+        ----------
+        npartitions : int, optional, default = None
+            Number of partitions of the returned Series, defaults to the current number of partitions
+
+        Returns
+        -------
+        new Series object
+        """
+        from thunder.rdds.keys import _KeyRangeIndex
+
+        if npartitions is None:
+            npartitions = self.rdd.getNumPartitions()
+        keyIndex = _KeyRangeIndex(self.dims, npartitions)
+        rdd = self.rdd.partitionBy(npartitions, keyIndex.partitionOf)
+        out = self._constructor(rdd).__finalize__(self)
+        out._keyIndex = keyIndex
+        return out
+
+    def sortByKey(self):
+        """
+        Sort records by keys.
+
+        Records are sorted according to the convention that the first key varies fastest, then the second,
+        then the third, etc. If the dimensions of this Series are already known, records are range-partitioned
+        by the linear index of their keys (see indexByKey), without sampling the keys, and each partition is
+        then sorted with a single argsort of its linear indices. Partitions holding keys outside of the known
+        dimensions, as after an operation that changed the keys, are sorted by their reversed key tuples
+        instead. If the dimensions are not known, see Data.sortByKey.
+        """
+        if not self._dims:
+            return super(Series, self).sortByKey()
+        indexed = self.indexByKey()
+        keyIndex = indexed._keyIndex
+        rdd = indexed.rdd.mapPartitions(lambda kvIter: _sortPartition(kvIter, keyIndex), preservesPartitioning=True)
+        out = self._constructor(rdd).__finalize__(self)
+        out._keyIndex = keyIndex
+        return out
+
+    def _partitionsOf(self, keys):
+        if self._keyIndex is None:
+            return None
+        return self._keyIndex.partitionsOf(keys)
+
+    def _partitionsOfRange(self, sliceOrSlices):
+        if self._keyIndex is None:
+            return None
+        return self._keyIndex.partitionsOfRange(sliceOrSlices)
+
     def between(self, left, right, inclusive=True):
         """
         Select subset of values within the given index range
@@ -192,20 +429,24 @@ class Series(Data):
             return self
 
         # use fast logical indexing to get the new values
-        subInds = where(map(lambda x: crit(x), index))
-        rdd = self.rdd.mapValues(lambda x: x[subInds])
+        subInds = where(map(lambda x: crit(x), index))[0]
 
         # if singleton, need to check whether it's an array or a scalar/int
-        # if array, recompute a new set of indices
+        # if array, recompute a new set of indices; numeric values are always scalars
         if len(newIndex) == 1:
-            rdd = rdd.mapValues(lambda x: x[0])
-            val = rdd.first()[1]
-            if size(val) == 1:
-                newIndex = newIndex[0]
+            i = subInds[0]
+            new = self._applyValuesLazily(lambda x: x[i], lambda x: x[:, i])
+            if self._dtype and self._dtype != 'object':
+                new._index = [newIndex[0]]
             else:
-                newIndex = arange(0, size(val))
+                val = new.first()[1]
+                if size(val) == 1:
+                    new._index = [newIndex[0]]
+                else:
+                    new._index = arange(0, size(val))
+            return new
 
-        return self._constructor(rdd, index=newIndex).__finalize__(self)
+        return self._applyValuesLazily(lambda x: x[subInds], lambda x: x[:, subInds], index=newIndex)
 
     def center(self, axis=0):
         """
@@ -218,10 +459,11 @@ class Series(Data):
             Which axis to center along, rows (0) or columns (1)
         """
         if axis == 0:
-            return self.applyValues(lambda x: x - mean(x))
+            return self._applyValuesBatched(lambda x: x - mean(x),
+                                            lambda x: x - mean(x, axis=1)[:, newaxis], keepIndex=True)
         elif axis == 1:
             meanVec = self.mean()
-            return self.applyValues(lambda x: x - meanVec)
+            return self._applyValuesBatched(lambda x: x - meanVec, keepIndex=True)
         else:
             raise Exception('Axis must be 0 or 1')
 
@@ -236,10 +478,11 @@ class Series(Data):
             Which axis to standardize along, rows (0) or columns (1)
         """
         if axis == 0:
-            return self.applyValues(lambda x: x / std(x))
+            return self._applyValuesBatched(lambda x: x / std(x),
+                                            lambda x: x / std(x, axis=1)[:, newaxis], keepIndex=True)
         elif axis == 1:
             stdvec = self.stdev()
-            return self.applyValues(lambda x: x / stdvec)
+            return self._applyValuesBatched(lambda x: x / stdvec, keepIndex=True)
         else:
             raise Exception('Axis must be 0 or 1')
 
@@ -255,12 +498,14 @@ class Series(Data):
             Which axis to zscore along, rows (0) or columns (1)
         """
         if axis == 0:
-            return self.applyValues(lambda x: (x - mean(x)) / std(x))
+            return self._applyValuesBatched(lambda x: (x - mean(x)) / std(x),
+                                            lambda x: (x - mean(x, axis=1)[:, newaxis]) / std(x, axis=1)[:, newaxis],
+                                            keepIndex=True)
         elif axis == 1:
             stats = self.stats()
             meanVec = stats.mean()
             stdVec = stats.stdev()
-            return self.applyValues(lambda x: (x - meanVec) / stdVec)
+            return self._applyValuesBatched(lambda x: (x - meanVec) / stdVec, keepIndex=True)
         else:
             raise Exception('Axis must be 0 or 1')
 
@@ -288,19 +533,21 @@ class Series(Data):
         if s.ndim == 1:
             if size(s) != size(self.index):
                 raise Exception('Size of signal to correlate with, %g, does not match size of series' % size(s))
-            rdd = self.rdd.mapValues(lambda x: corrcoef(x, s)[0, 1])
+            func = lambda x: corrcoef(x, s)[0, 1]
+            batchFunc = lambda x: _corrRows(x, s[newaxis, :])[:, 0]
             newIndex = 0
         # handle multiple 1d signals
         elif s.ndim == 2:
             if s.shape[1] != size(self.index):
                 raise Exception('Length of signals to correlate with, %g, does not match size of series' % s.shape[1])
-            rdd = self.rdd.mapValues(lambda x: array([corrcoef(x, y)[0, 1] for y in s]))
+            func = lambda x: array([corrcoef(x, y)[0, 1] for y in s])
+            batchFunc = lambda x: _corrRows(x, s)
             newIndex = range(0, s.shape[0])
         else:
             raise Exception('Signal to correlate with must have 1 or 2 dimensions')
 
         # return result
-        return self._constructor(rdd, dtype='float64', index=newIndex).__finalize__(self)
+        return self._applyValuesLazily(func, batchFunc, dtype='float64', index=newIndex)
 
     def seriesMax(self):
         """ Compute the value maximum of each record in a Series """
@@ -331,8 +578,9 @@ class Series(Data):
         q : scalar
             Floating point number between 0 and 100 inclusive, specifying percentile.
         """
-        rdd = self.rdd.mapValues(lambda x: percentile(x, q))
-        return self._constructor(rdd, index=q).__finalize__(self, noPropagate=('_dtype',))
+        func = lambda x: percentile(x, q)
+        return self._applyValuesLazily(func, lambda x: percentile(x, q, axis=1), noPropagate=('_dtype',),
+                                       index=q, dtype=self._inferDtype(func))
 
     def seriesStdev(self):
         """ Compute the value std of each record in a Series """
@@ -356,17 +604,30 @@ class Series(Data):
             'min': min,
             'count': size
         }
+        BATCHSTATS = {
+            'sum': lambda x: sum(x, axis=1),
+            'mean': lambda x: mean(x, axis=1),
+            'median': lambda x: median(x, axis=1),
+            'stdev': lambda x: std(x, axis=1),
+            'max': lambda x: amax(x, axis=1),
+            'min': lambda x: amin(x, axis=1),
+            'count': lambda x: [x.shape[1]] * x.shape[0]
+        }
         func = STATS[stat.lower()]
-        rdd = self.rdd.mapValues(lambda x: func(x))
-        return self._constructor(rdd, index=stat).__finalize__(self, noPropagate=('_dtype',))
+        return self._applyValuesLazily(lambda x: func(x), BATCHSTATS[stat.lower()], noPropagate=('_dtype',),
+                                       index=stat, dtype=self._inferDtype(func))
 
     def seriesStats(self):
         """
         Compute many statistics for each record in a Series
         """
-        rdd = self.rdd.mapValues(lambda x: array([x.size, mean(x), std(x), max(x), min(x)]))
-        return self._constructor(rdd, index=['count', 'mean', 'std', 'max', 'min'])\
-            .__finalize__(self, noPropagate=('_dtype',))
+        def batchStats(x):
+            return column_stack([[x.shape[1]] * x.shape[0], mean(x, axis=1), std(x, axis=1),
+                                 amax(x, axis=1), amin(x, axis=1)])
+
+        func = lambda x: array([x.size, mean(x), std(x), max(x), min(x)])
+        return self._applyValuesLazily(func, batchStats, noPropagate=('_dtype',),
+                                       index=['count', 'mean', 'std', 'max', 'min'], dtype=self._inferDtype(func))
 
     def maxProject(self, axis=0):
         """
@@ -374,7 +635,7 @@ class Series(Data):
         """
         import copy
         dims = copy.copy(self.dims)
-        nkeys = len(self.first()[0])
+        nkeys = len(dims)
         if axis > nkeys - 1:
             raise IndexError('only %g keys, cannot compute maximum along axis %g' % (nkeys, axis))
         rdd = self.rdd.map(lambda (k, v): (tuple(array(k)[arange(0, nkeys) != axis]), v)).reduceByKey(maximum)
@@ -398,7 +659,9 @@ class Series(Data):
 
         converter = _subToIndConverter(self.dims.count, order=order, isOneBased=isOneBased)
         rdd = self.rdd.map(lambda (k, v): (converter(k), v))
-        return self._constructor(rdd, index=self._index).__finalize__(self)
+        out = self._constructor(rdd, index=self._index).__finalize__(self, noPropagate=('_nkeys',))
+        out._nkeys = 1
+        return out
 
     def indToSub(self, order='F', isOneBased=True, dims=None):
         """
@@ -422,9 +685,11 @@ class Series(Data):
 
         converter = _indToSubConverter(dims, order=order, isOneBased=isOneBased)
         rdd = self.rdd.map(lambda (k, v): (converter(k), v))
-        return self._constructor(rdd, index=self._index).__finalize__(self)
+        out = self._constructor(rdd, index=self._index).__finalize__(self, noPropagate=('_nkeys',))
+        out._nkeys = size(dims)
+        return out
 
-    def pack(self, selection=None, sorting=False, transpose=False, dtype=None, casting='safe'):
+    def pack(self, selection=None, sorting=False, transpose=False, dtype=None, casting='safe', memmapPath=None):
         """
         Pack a Series into a local array (e.g. for saving)
 
@@ -434,14 +699,18 @@ class Series(Data):
         size (such as by seriesMean(), select(), or the `selection` parameter) before attempting to
         pack() a large data set.
 
+        Partitions are streamed to the driver one at a time, and the values of each are written directly
+        into a preallocated output array at positions given by their keys. The order of records is therefore
+        irrelevant, and driver memory use is limited to the output array plus a single partition.
+
         Parameters
         ----------
         selection : function, list, str, or int, optional, default None
             Criterion for selecting a subset, list, or index value
 
         sorting : boolean, optional, default False
-            Whether to sort the local array based on the keys. In most cases the returned array will
-            already be ordered correctly, and so an explicit sorting=True is typically not necessary.
+            Has no effect, as values are always placed in the returned array according to their keys.
+            Retained for backwards compatibility.
 
         transpose : boolean, optional, default False
             Transpose the spatial dimensions of the returned array.
@@ -453,6 +722,10 @@ class Series(Data):
         casting: casting: 'no'|'equiv'|'safe'|'same_kind'|'unsafe', optional, default 'safe'
             Casting method to pass on to numpy's astype() method if dtype is given; see numpy documentation for details.
 
+        memmapPath: string, optional, default None
+            If given, the output array will be a numpy memmap backed by a new file at this path on the driver,
+            rather than held in memory. This allows packing results larger than the available driver memory.
+
         Returns
         -------
         result: numpy array
@@ -463,6 +736,8 @@ class Series(Data):
             and will pack into an array with shape (4, 64, 128). If transpose is true, the spatial dimensions
             will be reversed, so that in this example the shape of the returned array will be (4, 128, 64).
         """
+        from numpy import memmap, prod
+
         if selection:
             out = self.select(selection)
         else:
@@ -471,16 +746,26 @@ class Series(Data):
         if not (dtype is None):
             out = out.astype(dtype, casting)
 
-        if sorting is True:
-            result = out.sortByKey().values().collect()
+        dims = self.dims
+        count = tuple(dims.count)
+        nout = len(out.index)
+        shape = (int(prod(count)), nout)
+        if memmapPath is None:
+            result = zeros(shape, dtype=out.dtype)
         else:
-            result = out.rdd.values().collect()
+            result = memmap(memmapPath, dtype=out.dtype, mode='w+', shape=shape)
 
-        nout = size(result[0])
+        # each partition arrives as an array of linear indices (first key changing fastest) and
+        # an array of values; scatter the values into the rows of the output
+        chunks = out.rdd.mapPartitions(lambda kvIter: _packPartition(kvIter, dims.min, count))
+        for inds, values in toLocalIterator(chunks):
+            result[inds] = values.reshape((len(inds), nout))
+        if memmapPath is not None:
+            result.flush()
 
-        # reshape into a dense array of shape (b, x, y, z)  or (b, x, y) or (b, x)
+        # view as a dense array of shape (b, x, y, z)  or (b, x, y) or (b, x)
         # where b is the number of outputs per record
-        out = asarray(result).reshape(((nout,) + self.dims.count)[::-1]).T
+        out = result.reshape(count[::-1] + (nout,)).T
 
         if transpose:
             # swap arrays so that in-memory representation matches that
@@ -531,10 +816,12 @@ class Series(Data):
 
     def query(self, inds, var='inds', order='F', isOneBased=True):
         """
-        Extract records with indices matching those provided
+        Extract records with indices matching those provided, and average them within each set of indices
 
-        Keys will be automatically linearized before matching to provided indices.
-        This will not affect
+        Keys will be automatically linearized before matching to provided indices. This will not affect
+        the keys of this Series.
+
+        All regions are averaged together in a single pass over the data, and may overlap.
 
         Parameters
         ----------
@@ -553,11 +840,11 @@ class Series(Data):
 
         Returns
         -------
-        keys : array, shape (n, k) where k is the length of each value
-            Averaged values
-
-        values : array, shape (n, d) where d is the number of keys
+        keys : array, shape (n, d) where d is the number of keys
             Averaged keys
+
+        values : array, shape (n, k) where k is the length of each value
+            Averaged values
         """
         if isinstance(inds, str):
             inds = loadMatVar(inds, var)[0]
@@ -570,17 +857,36 @@ class Series(Data):
         converter = _indToSubConverter(dims=self.dims.max, order=order, isOneBased=isOneBased)
 
         keys = zeros((n, len(self.dims.count)))
-        values = zeros((n, len(self.first()[1])))
-
-        data = self.subToInd(order=order, isOneBased=isOneBased)
+        values = zeros((n, len(self.index)))
 
+        # transform indices into map from linear index to sequence of region indices
+        regionLookup = {}
         for idx, indList in enumerate(inds):
             if len(indList) > 0:
-                indsSet = set(asarray(indList).flat)
-                bcInds = self.rdd.context.broadcast(indsSet)
-                values[idx, :] = data.filterOnKeys(lambda k: k in bcInds.value).values().mean()
+                for ind in set(asarray(indList).flat):
+                    regionLookup.setdefault(ind, []).append(idx)
                 keys[idx, :] = mean(map(lambda k: converter(k), indList), axis=0)
 
+        bcRegionLookup = self.rdd.context.broadcast(regionLookup)
+
+        def partitionRegionSums(kvIter):
+            regionLookup_ = bcRegionLookup.value
+            sums = {}
+            for k, v in kvIter:
+                for idx_ in regionLookup_.get(k, []):
+                    if idx_ in sums:
+                        n_, sum_ = sums[idx_]
+                        sums[idx_] = (n_ + 1, sum_ + v)
+                    else:
+                        sums[idx_] = (1, asarray(v, dtype='float64'))
+            return sums.iteritems()
+
+        data = self.subToInd(order=order, isOneBased=isOneBased)
+        regionSums = data.rdd.mapPartitions(partitionRegionSums) \
+            .reduceByKey(lambda (n1, sum1), (n2, sum2): (n1 + n2, sum1 + sum2)).collect()
+        for idx, (count, regionSum) in regionSums:
+            values[idx, :] = regionSum / count
+
         return keys, values
 
     def __maskToKeys(self, mask, returnNested=False):
@@ -695,6 +1001,12 @@ class Series(Data):
         and so on). If another type of ndarray is passed, then all nonzero mask elements will be interpreted
         as a single region.
 
+        Regions given by a mask are averaged by broadcasting a dense array of region labels, reducing the
+        records of each partition into per-region sums with vectorized operations, and tree-reducing these
+        sums on the driver. Only one array of sums per partition is transferred, rather than every record in
+        every region. The result is computed immediately, and with `validate` set a ValueError is raised on
+        the driver.
+
         This method returns a new Series object, with one record per defined region. Record keys will be the mean of
         keys within the region, while record values will be the mean of values in the region. The `dims` attribute on
         the new Series will not be set; all other attributes will be as in the source Series object.
@@ -714,7 +1026,7 @@ class Series(Data):
         new Series object
         """
         if isinstance(nestedKeys, ndarray):
-            nestedKeys = self.__maskToKeys(nestedKeys, returnNested=True)
+            return self._meanByMaskRegions(nestedKeys, validate=validate)
 
         # transform keys into map from keys to sequence of region indices
         regionLookup = {}
@@ -751,7 +1063,70 @@ class Series(Data):
         else:
             data = combinedData.map(lambda (region_, (_, keyMean, valMean)):
                                     (tuple(keyMean.astype('int16')), valMean))
-        return self._constructor(data).__finalize__(self, noPropagate=('_dims',))
+        return self._constructor(data).__finalize__(self, noPropagate=('_dims', '_nkeys'))
+
+    def _meanByMaskRegions(self, mask, validate=False, depth=2):
+        """
+        Implementation of meanByRegions for an ndarray mask, see Series.meanByRegions.
+        """
+        from numpy import searchsorted, unique, bincount
+
+        if not isinstance(mask, ndarray):
+            raise ValueError("Mask should be numpy ndarray, got: '%s'" % str(type(mask)))
+        if self._dims:
+            if mask.shape != self._dims.count:
+                raise ValueError("Shape mismatch between mask '%s' and series '%s'; shapes must be equal" %
+                                 (str(mask.shape), str(self._dims.count)))
+
+        # dense array holding the index of the region of each key, -1 if in none; regions are
+        # sorted by mask value for integer masks, with a single region otherwise
+        regions = zeros(mask.shape, dtype='int32') - 1
+        if mask.dtype.kind in ('i', 'u'):
+            labels = unique(mask[mask != 0])
+            regions[mask != 0] = searchsorted(labels, mask[mask != 0])
+        else:
+            labels = [1]
+            regions[mask != 0] = 0
+        nregions = len(labels)
+        nRecsInRegion = bincount(regions[regions >= 0], minlength=nregions)
+
+        bcRegions = self.rdd.context.broadcast(regions)
+
+        def partitionSums(kvIter):
+            return _regionSums(kvIter, bcRegions.value, nregions)
+
+        def combineSums(left, right):
+            if left is None:
+                return right
+            if right is None:
+                return left
+            return left[0] + right[0], left[1] + right[1], left[2] + right[2], left[3]
+
+        totals = treeAggregate(self.rdd.mapPartitions(partitionSums), None, combineSums, combineSums, depth)
+
+        records = []
+        dtype = 'float64'
+        if totals is not None:
+            counts, keySums, valSums, valDtype = totals
+            if valDtype.kind == 'f':
+                dtype = str(valDtype)
+            if validate:
+                for region in xrange(nregions):
+                    if nRecsInRegion[region] != counts[region]:
+                        raise ValueError("%d records were expected in region %d, but only %d were found" %
+                                         (nRecsInRegion[region], region, counts[region]))
+            for region in xrange(nregions):
+                if counts[region] > 0:
+                    keyMean = keySums[region] / counts[region]
+                    valMean = valSums[region] / counts[region]
+                    if valDtype.kind == 'f':
+                        valMean = valMean.astype(valDtype)
+                    records.append((tuple(keyMean.astype('int16')), valMean))
+
+        # means of integer values are floats, so the dtype of this Series is not kept
+        data = self.rdd.context.parallelize(records, max(min(len(records), self.rdd.getNumPartitions()), 1))
+        return self._constructor(data, nrecords=len(records), dtype=dtype).__finalize__(
+            self, noPropagate=('_dims', '_nkeys'))
 
     def toBlocks(self, blockSizeSpec="150M"):
         """
@@ -862,10 +1237,11 @@ class Series(Data):
 
         binseriesrdd.foreach(writer.writerFcn)
 
-        # TODO: all we really need here are the number of keys and number of values, which could in principle
-        # be cached in _nkeys and _nvals attributes, removing the need for this .first() call in most cases.
-        firstKey, firstVal = self.first()
-        writeSeriesConfig(outputDirPath, len(firstKey), len(firstVal), keyType='int16', valueType=self.dtype,
+        # the number of keys and values are normally known without looking at the data; if not, this will
+        # fall back to a first() call
+        if self._nkeys is None:
+            self.populateParamsFromFirstRecord()
+        writeSeriesConfig(outputDirPath, self._nkeys, len(self.index), keyType='int16', valueType=self.dtype,
                           overwrite=overwrite, awsCredentialsOverride=awsCredentials)
 
     def toRowMatrix(self):
@@ -875,6 +1251,17 @@ class Series(Data):
         from thunder.rdds.matrices import RowMatrix
         return RowMatrix(self.rdd).__finalize__(self)
 
+    def toBlockedSeries(self, chunkSize=None):
+        """
+        Convert Series to BlockedSeries
+
+        See also
+        --------
+        BlockedSeries.fromSeries
+        """
+        from thunder.rdds.blockedseries import BlockedSeries
+        return BlockedSeries.fromSeries(self, chunkSize=chunkSize)
+
     def toTimeSeries(self):
         """
         Convert Series to TimeSeries
@@ -890,6 +1277,162 @@ class Series(Data):
         return SpatialSeries(self.rdd).__finalize__(self)
 
 
+def _partitionDims(keyIter):
+    """
+    Returns a list holding the Dimensions of the keys in a partition, computed with one vectorized min
+    and max over an array of the keys, or an empty list if the partition is empty.
+    """
+    keys = asarray(list(keyIter))
+    if keys.size == 0:
+        return []
+    keys = keys.reshape((keys.shape[0], -1))
+    return [Dimensions(values=[amin(keys, axis=0).tolist(), amax(keys, axis=0).tolist()], n=keys.shape[1])]
+
+
+def _packPartition(kvIter, dimsMin, dimsCount):
+    """
+    Converts the records in a partition into a single pair of arrays, holding the linear index of each key
+    within dimensions of size `dimsCount` starting at `dimsMin` (first key changing fastest), and the
+    stacked values. Returns an empty list if the partition is empty.
+    """
+    from numpy import ravel_multi_index
+
+    keys = []
+    values = []
+    for k, v in kvIter:
+        keys.append(k)
+        values.append(v)
+    if not keys:
+        return []
+    subs = asarray(keys).reshape((len(keys), -1)) - asarray(dimsMin)
+    inds = ravel_multi_index(tuple(subs.T), dimsCount, order='F')
+    return [(inds, asarray(values))]
+
+
+def _regionSums(kvIter, regions, nregions):
+    """
+    Sums the keys and values of the records in a partition by region, where `regions` is a dense array
+    giving the index of the region of each key, or -1 for none.
+
+    Returns a list holding a tuple of the number of records, the sum of keys, and the sum of values in
+    each region, along with the dtype of the values; or an empty list if no records fall in any region.
+    """
+    from numpy import add, all, argsort, bincount, concatenate, flatnonzero, float64
+
+    keys = []
+    values = []
+    for k, v in kvIter:
+        keys.append(k)
+        values.append(v)
+    if not keys:
+        return []
+    keys = asarray(keys).reshape((len(keys), -1))
+    values = asarray(values)
+    valDtype = values.dtype
+    values = values.reshape((len(keys), -1))
+
+    # ignore keys falling outside of the region array
+    inBounds = all((keys >= 0) & (keys < asarray(regions.shape)), axis=1)
+    keys, values = keys[inBounds], values[inBounds]
+    recRegions = regions[tuple(keys.T)]
+    inRegion = recRegions >= 0
+    if not inRegion.any():
+        return []
+    keys, values, recRegions = keys[inRegion], values[inRegion], recRegions[inRegion]
+
+    # sort by region, then sum each run of records in the same region
+    order = argsort(recRegions, kind='mergesort')
+    keys, values, recRegions = keys[order], values[order], recRegions[order]
+    starts = concatenate(([0], flatnonzero(recRegions[1:] != recRegions[:-1]) + 1))
+    present = recRegions[starts]
+
+    counts = bincount(recRegions, minlength=nregions)
+    keySums = zeros((nregions, keys.shape[1]))
+    keySums[present] = add.reduceat(keys.astype(float64), starts, axis=0)
+    valSums = zeros((nregions, values.shape[1]))
+    valSums[present] = add.reduceat(values.astype(float64), starts, axis=0)
+    return [(counts, keySums, valSums, valDtype)]
+
+
+def _sortPartition(kvIter, keyIndex):
+    """
+    Sorts the records in a partition by the linear index of their keys, as given by a _KeyRangeIndex.
+
+    If any key falls outside of the dimensions of the index, the records are instead sorted by their
+    reversed key tuples, as in Data.sortByKey.
+    """
+    from numpy import argsort
+
+    records = list(kvIter)
+    if not records:
+        return []
+    keys = [k for k, _ in records]
+    if not keyIndex.containsAll(keys):
+        return sorted(records, key=lambda (k, _): tuple(k)[::-1])
+    order = argsort(keyIndex.linearIndices(keys), kind='mergesort')
+    return [records[i] for i in order]
+
+
+def _stack(values):
+    """
+    Stacks a list of values into a two-dimensional array with one value per row.
+
+    Returns None if the values cannot be stacked into a single two-dimensional array
+    (for instance if they are scalars or of differing lengths).
+    """
+    if values and all(isinstance(v, ndarray) and v.ndim == 1 for v in values):
+        n = len(values[0])
+        if all(len(v) == n for v in values):
+            return asarray(values)
+    return None
+
+
+def _applyToStackedPartition(kvIter, steps):
+    """
+    Applies a sequence of (func, batchFunc) steps to the values of a partition, using batchFunc on the
+    stacked values where possible and falling back to applying func record by record otherwise.
+    Returns a list of (key, result) pairs.
+    """
+    keys = []
+    values = []
+    for k, v in kvIter:
+        keys.append(k)
+        values.append(v)
+    stacked = _stack(values)
+    if stacked is not None:
+        values = None
+    for func, batchFunc in steps:
+        if stacked is not None and batchFunc is not None:
+            out = asarray(batchFunc(stacked))
+            if out.ndim == 2:
+                stacked = out
+            else:
+                stacked, values = None, list(out)
+            continue
+        if values is None:
+            values = list(stacked)
+        values = [func(v) for v in values]
+        stacked = _stack(values)
+        if stacked is not None:
+            values = None
+    if values is None:
+        values = list(stacked)
+    return zip(keys, values)
+
+
+def _corrRows(x, s):
+    """
+    Pearson correlation of each row of x against each row of s, returned as an array
+    of shape (x.shape[0], s.shape[0]).
+    """
+    from numpy import dot, sqrt
+    xc = x - mean(x, axis=1)[:, newaxis]
+    sc = s - mean(s, axis=1)[:, newaxis]
+    xnorm = sqrt(sum(xc ** 2, axis=1))
+    snorm = sqrt(sum(sc ** 2, axis=1))
+    return dot(xc, sc.T) / xnorm[:, newaxis] / snorm[newaxis, :]
+
+
 class _MeanCombiner(object):
     @staticmethod
     def createZeroTuple():
@@ -1,6 +1,8 @@
 from numpy import sqrt, pi, angle, fft, fix, zeros, roll, dot, mean, \
-    array, size, diag, tile, ones, asarray, polyfit, polyval, arange, \
-    percentile, ceil, float64
+    array, size, ones, asarray, arange, percentile, float64, newaxis, \
+    column_stack, vander, empty, floor, sort, minimum, add, interp, take, \
+    concatenate, linspace, identity, cos, outer, exp, log2, hstack, conj, \
+    unique, full, where, clip, repeat, maximum, errstate, ceil
 
 from thunder.rdds.series import Series
 from thunder.utils.common import loadMatVar, checkParams
@@ -42,31 +44,49 @@ class TimeSeries(Series):
         Construct an average time series triggered on each of several events,
         considering a range of lags before and after the event
 
+        The averages for all event types and lags are computed together, by applying
+        a single sparse averaging operator to each series.
+
         Parameters
         ----------
-        events : array-like
-            List of events to trigger on
+        events : array-like, or dict
+            List of events to trigger on, or a dict mapping each of several
+            event types (conditions) to a list of events
 
         lag : int
             Range of lags to consider, will cover (-lag, +lag)
+
+        Returns
+        -------
+        Series with the average at each lag as values, indexed by lag. If events is a dict, the
+        averages for each condition follow each other, in sorted order of the conditions,
+        indexed by (condition, lag)
         """
-        events = asarray(events)
-        m = zeros((lag*2+1, len(self.index)))
-        for i, shift in enumerate(range(-lag, lag+1)):
-            fillInds = events + shift
-            fillInds = fillInds[fillInds >= 0]
-            fillInds = fillInds[fillInds < len(self.index)]
-            m[i, fillInds] = 1
-
-        if lag == 0:
-            newIndex = 0
+        from scipy.sparse import csr_matrix
+
+        n = len(self.index)
+        shifts = range(-lag, lag+1)
+        if isinstance(events, dict):
+            conditions = sorted(events.keys())
+            eventLists = [asarray(events[c], dtype=int) for c in conditions]
+            newIndex = [(c, shift) for c in conditions for shift in shifts]
         else:
-            newIndex = range(-lag, lag+1)
+            eventLists = [asarray(events, dtype=int)]
+            newIndex = 0 if lag == 0 else shifts
+
+        # one row per condition and lag, selecting the time points to average
+        rows, cols = [], []
+        for i, (eventList, shift) in enumerate([(e, shift) for e in eventLists for shift in shifts]):
+            fillInds = eventList + shift
+            fillInds = unique(fillInds[(fillInds >= 0) & (fillInds < n)])
+            rows.append(full(len(fillInds), i, dtype=int))
+            cols.append(fillInds)
+        rows, cols = concatenate(rows), concatenate(cols)
+        m = csr_matrix((ones(len(rows)), (rows, cols)), shape=(len(eventLists) * len(shifts), n))
 
-        scale = m.sum(axis=1)
+        scale = asarray(m.sum(axis=1)).ravel()
 
-        rdd = self.rdd.mapValues(lambda x: dot(m, x) / scale)
-        return self._constructor(rdd, index=newIndex).__finalize__(self)
+        return self._applyValuesLazily(lambda x: m.dot(x) / scale, lambda x: m.dot(x.T).T / scale, index=newIndex)
 
     def blockedAverage(self, blockLength):
         """
@@ -89,12 +109,12 @@ class TimeSeries(Series):
             raise Exception('Trial length, %g, cannot be length of entire time series, %g'
                             % (blockLength, n))
 
-        m = tile(diag(ones((blockLength,))), [n/blockLength, 1]).T
         newIndex = range(0, blockLength)
-        scale = n / blockLength
+        nblocks = n / blockLength
 
-        rdd = self.rdd.mapValues(lambda x: dot(m, x) / scale)
-        return self._constructor(rdd, index=newIndex).__finalize__(self)
+        return self._applyValuesLazily(lambda x: mean(x.reshape((nblocks, blockLength)), axis=0),
+                                       lambda x: mean(x.reshape((x.shape[0], nblocks, blockLength)), axis=1),
+                                       index=newIndex)
 
     def subsample(self, sampleFactor=2):
         """
@@ -109,171 +129,495 @@ class TimeSeries(Series):
             raise Exception('Factor for subsampling must be postive, got %g' % sampleFactor)
         s = slice(0, len(self.index), sampleFactor)
         newIndex = self.index[s]
-        return self._constructor(
-            self.rdd.mapValues(lambda v: v[s]), index=newIndex).__finalize__(self)
+        return self._applyValuesLazily(lambda v: v[s], lambda v: v[:, s], index=newIndex)
+
+    def resample(self, factor=None, rate=None, fs=1.0):
+        """
+        Resample time series by a rational factor, with anti-aliasing
+
+        Uses polyphase filtering, upsampling by p, applying an FIR low-pass filter and downsampling by q,
+        where p/q is the resampling factor. Unlike subsample(), this suppresses aliasing of frequencies above
+        the new Nyquist frequency. The time index is resampled accordingly, assuming it is evenly spaced.
+
+        Parameters
+        ----------
+        factor : float or tuple of ints (p, q), optional, default = None
+            Ratio of the new to the current sampling rate, approximated by a fraction with a denominator
+            of at most 100 unless given as a tuple. Either factor or rate must be given
+
+        rate : float, optional, default = None
+            New sampling rate, in the same units as fs
+
+        fs : float, optional, default = 1.0
+            Current sampling rate, used only with rate
+        """
+        from fractions import Fraction
+        from scipy.signal import resample_poly
+
+        if (factor is None) == (rate is None):
+            raise ValueError('Exactly one of factor or rate must be given')
+        if factor is None:
+            factor = rate / float(fs)
+        if isinstance(factor, tuple):
+            up, down = factor
+        else:
+            frac = Fraction(factor).limit_denominator(100)
+            up, down = frac.numerator, frac.denominator
+        if up <= 0 or down <= 0:
+            raise ValueError('Factor for resampling must be positive, got %s' % str(factor))
+
+        n = len(self.index)
+        newLength = -(-n * up / down)
+        index = asarray(self.index)
+        if n > 1 and index.dtype.kind in 'iuf':
+            step = (index[1] - index[0]) * down / float(up)
+            newIndex = index[0] + arange(newLength) * step
+        else:
+            newIndex = arange(newLength)
+
+        def getBatch(y):
+            return resample_poly(asarray(y, dtype=float64), up, down, axis=1)
+
+        def get(y):
+            return getBatch(y[newaxis, :])[0]
+
+        return self._applyValuesLazily(get, getBatch, dtype='float64', index=newIndex)
+
+    def temporalFilter(self, kind='lowpass', cutoff=0.1, order=4, method='iir', fs=1.0):
+        """
+        Filter each time series in time, without phase distortion
+
+        The filter is designed once, and applied forwards and backwards (as in scipy.signal.filtfilt),
+        so that the phase response is zero and the magnitude response is squared.
+
+        Parameters
+        ----------
+        kind : str, optional, default = 'lowpass'
+            Type of filter, options are 'lowpass', 'highpass', 'bandpass', and 'bandstop'
+
+        cutoff : float, or pair of floats, optional, default = 0.1
+            Cutoff frequency, or pair of frequencies for 'bandpass' and 'bandstop', in the same units as fs
+
+        order : int, optional, default = 4
+            Order of the filter. For 'fir', the number of taps is order + 1
+
+        method : str, optional, default = 'iir'
+            Filter design, options are 'iir', a Butterworth filter applied as second-order sections,
+            and 'fir', a windowed-sinc filter
+
+        fs : float, optional, default = 1.0
+            Sampling rate
+        """
+        from scipy.signal import butter, firwin, sosfiltfilt, filtfilt
+
+        checkParams(kind, ['lowpass', 'highpass', 'bandpass', 'bandstop'])
+        checkParams(method, ['iir', 'fir'])
+        kind = kind.lower()
+
+        nyquist = fs / 2.0
+        normCutoff = asarray(cutoff, dtype=float64) / nyquist
+
+        if method.lower() == 'iir':
+            sos = butter(order, normCutoff, btype=kind, output='sos')
+            batchFilter = lambda y: sosfiltfilt(sos, y, axis=1)
+        else:
+            # highpass and bandstop filters need an odd number of taps
+            numtaps = order + 1
+            if kind in ('highpass', 'bandstop') and numtaps % 2 == 0:
+                numtaps += 1
+            taps = firwin(numtaps, normCutoff, pass_zero=kind in ('lowpass', 'bandstop'))
+            batchFilter = lambda y: filtfilt(taps, [1.0], y, axis=1)
+
+        def getBatch(y):
+            return batchFilter(asarray(y, dtype=float64))
+
+        def get(y):
+            return getBatch(y[newaxis, :])[0]
+
+        return self._applyValuesBatched(get, getBatch, keepIndex=True)
 
     def fourier(self, freq=None):
         """
         Compute statistics of a Fourier decomposition on time series data
 
+        Coherence and phase at all requested frequencies are computed in a single pass. When only a few
+        frequencies are requested, their Fourier coefficients are computed directly, as one matrix product
+        with the corresponding complex exponentials, rather than with a full FFT; the total power needed for
+        the coherence is then obtained from the time domain.
+
         Parameters
         ----------
-        freq : int
-            Digital frequency at which to compute coherence and phase
+        freq : int, list of ints, or 'all', optional, default = 'all'
+            Digital frequency or frequencies at which to compute coherence and phase. 'all' requests
+            every frequency below half the series duration
+
+        Returns
+        -------
+        Series with values (coherence, phase) and index ['coherence', 'phase'] if freq is a single int,
+        otherwise the coherences followed by the phases at each requested frequency f, with index
+        [('coherence', f), ..., ('phase', f), ...]
         """
-        def get(y, freq):
-            y = y - mean(y)
-            nframes = len(y)
-            ft = fft.fft(y)
-            ft = ft[0:int(fix(nframes/2))]
-            ampFt = 2*abs(ft)/nframes
-            amp = ampFt[freq]
-            ampSum = sqrt(sum(ampFt**2))
-            co = amp / ampSum
-            ph = -(pi/2) - angle(ft[freq])
-            if ph < 0:
-                ph += pi * 2
-            return array([co, ph])
-
-        if freq >= int(fix(size(self.index)/2)):
-            raise Exception('Requested frequency, %g, is too high, must be less than half the series duration' % freq)
-
-        rdd = self.rdd.mapValues(lambda x: get(x, freq))
-        return Series(rdd, index=['coherence', 'phase']).__finalize__(self)
-
-    def convolve(self, signal, mode='full', var=None):
+        nframes = size(self.index)
+        nfreqs = int(fix(nframes/2))
+        if freq is None or (isinstance(freq, basestring) and freq.lower() == 'all'):
+            freqs = range(nfreqs)
+        else:
+            freqs = [int(f) for f in freq] if hasattr(freq, '__iter__') else [freq]
+        for f in freqs:
+            if f >= nfreqs:
+                raise Exception('Requested frequency, %g, is too high, must be less than half the series duration'
+                                % f)
+
+        # direct evaluation costs one complex multiply-add per time point and frequency, an FFT about log2 of that
+        if len(freqs) <= log2(max(nframes, 2)) / 2:
+            basis = exp(-2j * pi * outer(arange(nframes), freqs) / nframes)
+        else:
+            basis = None
+
+        def getBatch(y):
+            co, ph = _fourierStats(y, freqs, basis)
+            return hstack([co, ph])
+
+        def get(y):
+            return getBatch(y[newaxis, :])[0]
+
+        if hasattr(freq, '__iter__') or freq is None or isinstance(freq, basestring):
+            index = [('coherence', f) for f in freqs] + [('phase', f) for f in freqs]
+        else:
+            index = ['coherence', 'phase']
+        return self._applyValuesLazily(get, getBatch, constructor=Series, index=index)
+
+    def convolve(self, signal, mode='full', var=None, method='auto'):
         """
-        Conolve time series data against another signal
+        Convolve time series data against another signal, or against many signals
 
         Parameters
         ----------
         signal : array, or str
             Signal to convolve with, can be a numpy array or a
-            MAT file containing the signal as a variable
+            MAT file containing the signal as a variable. A two-dimensional
+            array holds one signal per row
 
         var : str
             Variable name if loading from a MAT file
 
         mode : str, optional, default='full'
-            Mode of convolution, options are 'full', 'same', and 'same'
-        """
+            Mode of convolution, options are 'full', 'same', and 'valid'
 
-        from numpy import convolve
+        method : str, optional, default = 'auto'
+            How to compute the convolution, options are 'direct', a sum of shifted copies of each series,
+            'fft', overlap-add convolution with real FFTs, or 'auto', which chooses the cheaper of the two
+            for the lengths of the series and signal
+
+        Returns
+        -------
+        Series with the convolution as values. For several signals, the convolutions with each signal
+        follow each other, indexed by (signal number, time)
+        """
+        checkParams(mode, ['full', 'same', 'valid'])
+        checkParams(method, ['auto', 'direct', 'fft'])
 
         if type(signal) is str:
             s = loadMatVar(signal, var)
+            # MAT files store vectors as two-dimensional arrays
+            if min(s.shape) == 1:
+                s = s.ravel()
         else:
             s = asarray(signal)
 
-        n = size(self.index)
-        m = size(s)
+        multiple = s.ndim == 2
+        if not multiple:
+            s = s[newaxis, :]
 
-        newrdd = self.rdd.mapValues(lambda x: convolve(x, signal, mode))
+        n = size(self.index)
+        nsignals, m = s.shape
 
-        # use expected lengths to make a new index
+        # use expected lengths to make a new index, and to select from the full convolution as numpy.convolve does
         if mode == 'same':
             newmax = max(n, m)
+            start = (min(n, m) - 1) / 2
         elif mode == 'valid':
             newmax = max(m, n) - min(m, n) + 1
+            start = min(m, n) - 1
         else:
             newmax = n+m-1
+            start = 0
         newindex = arange(0, newmax)
+        if multiple:
+            newindex = [(i, t) for i in range(nsignals) for t in newindex]
+
+        # overlap-add blocks of the series, no shorter than the signal and up to three times as long
+        fftLength = _nextFastLength(max(min(n, 3*m), m - 1) + m - 1)
+        blockLength = fftLength - m + 1
+        nblocks = -(-n / blockLength)
+        if method.lower() == 'auto':
+            directCost = nsignals * m * n
+            fftCost = (nsignals + 1) * nblocks * fftLength * log2(fftLength) / 2
+            method = 'fft' if directCost > fftCost else 'direct'
+
+        if method.lower() == 'fft':
+            sFreq = fft.rfft(s, fftLength, axis=1)
+            kernel = lambda y: _convolveOverlapAdd(y, sFreq, m, blockLength)
+        else:
+            kernel = lambda y: _convolveDirect(y, s)
+
+        def getBatch(y):
+            out = kernel(asarray(y, dtype=float64))[:, :, start:start+newmax]
+            return out.reshape((out.shape[0], -1))
+
+        def get(y):
+            return getBatch(y[newaxis, :])[0]
+
+        return self._applyValuesLazily(get, getBatch, dtype='float64', index=newindex)
+
+    def psd(self, nperseg=256, noverlap=None, window='hann', fs=1.0):
+        """
+        Estimate the power spectral density of each time series by Welch's method
+
+        Each series is split into overlapping segments, each segment has its mean removed and is
+        tapered by the window, and the one-sided periodograms of all segments are averaged.
+        Results match scipy.signal.welch with default detrending and density scaling.
+
+        Parameters
+        ----------
+        nperseg : int, optional, default = 256
+            Length of each segment, reduced to the length of the series if longer
+
+        noverlap : int, optional, default = nperseg / 2
+            Number of points by which consecutive segments overlap
+
+        window : str or tuple, optional, default = 'hann'
+            Window to apply to each segment, as accepted by scipy.signal.get_window
+
+        fs : float, optional, default = 1.0
+            Sampling frequency, determines the frequencies of the index
+
+        Returns
+        -------
+        Series with the power spectral density as values, indexed by frequency
+        """
+        nperseg, step, win, freqs = self._welchParams(nperseg, noverlap, window, fs)
+        # one-sided density: double all bins but DC and, for even lengths, Nyquist
+        scale = full(len(freqs), 2.0 / (fs * (win ** 2).sum()))
+        scale[0] /= 2
+        if nperseg % 2 == 0:
+            scale[-1] /= 2
+
+        def getBatch(y):
+            segs = _welchSegments(y, nperseg, step, win)
+            return (abs(segs) ** 2).mean(axis=1) * scale
+
+        def get(y):
+            return getBatch(y[newaxis, :])[0]
+
+        return self._applyValuesLazily(get, getBatch, constructor=Series, dtype='float64', index=freqs)
+
+    def coherence(self, signals, nperseg=256, noverlap=None, window='hann', fs=1.0):
+        """
+        Estimate the magnitude-squared coherence of each time series with one or many signals
+
+        Cross- and auto-spectra are estimated by Welch's method, as in psd(). The segment spectra of
+        the signals are computed once, and broadcast. Results match scipy.signal.coherence.
+
+        Parameters
+        ----------
+        signals : array
+            Signal to compute coherence with, or a two-dimensional array with one signal per row,
+            each of the same length as the series
+
+        nperseg, noverlap, window, fs :
+            Segmenting, windowing, and sampling frequency, see psd()
+
+        Returns
+        -------
+        Series with the coherence at each frequency as values, indexed by frequency. For several signals,
+        the coherences with each signal follow each other, indexed by (signal number, frequency)
+        """
+        s = asarray(signals, dtype=float64)
+        multiple = s.ndim == 2
+        if not multiple:
+            s = s[newaxis, :]
+        if s.shape[1] != size(self.index):
+            raise Exception('Length of signals to compute coherence with, %g, does not match size of series'
+                            % s.shape[1])
+
+        nperseg, step, win, freqs = self._welchParams(nperseg, noverlap, window, fs)
+        sSegs = _welchSegments(s, nperseg, step, win)
+        bcSignals = self._rdd.context.broadcast((sSegs, (abs(sSegs) ** 2).mean(axis=1)))
+        index = [(i, f) for i in range(s.shape[0]) for f in freqs] if multiple else freqs
+
+        def getBatch(y):
+            sSegs, sPower = bcSignals.value
+            segs = _welchSegments(y, nperseg, step, win)
+            power = (abs(segs) ** 2).mean(axis=1)
+            # cross-spectra of every row with every signal, averaged over segments
+            cross = (conj(segs)[:, newaxis, :, :] * sSegs[newaxis, :, :, :]).mean(axis=2)
+            with errstate(divide='ignore', invalid='ignore'):
+                coh = abs(cross) ** 2 / (power[:, newaxis, :] * sPower[newaxis, :, :])
+            return coh.reshape((y.shape[0], -1))
 
-        return self._constructor(newrdd, index=newindex).__finalize__(self)
+        def get(y):
+            return getBatch(y[newaxis, :])[0]
+
+        return self._applyValuesLazily(get, getBatch, constructor=Series, dtype='float64', index=index)
 
-    def crossCorr(self, signal, lag=0, var=None):
+    def _welchParams(self, nperseg, noverlap, window, fs):
+        """
+        Returns the segment length, step between segments, window, and frequencies of Welch's method
+        for this series and the given parameters.
         """
-        Cross correlate time series data against another signal
+        from scipy.signal import get_window
+
+        nperseg = min(nperseg, size(self.index))
+        if noverlap is None:
+            noverlap = nperseg / 2
+        if noverlap >= nperseg:
+            raise ValueError('Segment overlap, %g, must be less than segment length, %g' % (noverlap, nperseg))
+        win = get_window(window, nperseg)
+        freqs = fft.rfftfreq(nperseg, 1.0 / fs)
+        return nperseg, nperseg - noverlap, win, freqs
+
+    def crossCorr(self, signal, lag=0, var=None, method='auto'):
+        """
+        Cross correlate time series data against another signal, or against many signals
 
         Parameters
         ----------
         signal : array, or str
             Signal to correlate against, can be a numpy array or a
-            MAT file containing the signal as a variable
+            MAT file containing the signal as a variable. A two-dimensional
+            array holds one signal per row
 
         var : str
             Variable name if loading from a MAT file
 
         lag : int
             Range of lags to consider, will cover (-lag, +lag)
+
+        method : str, optional, default = 'auto'
+            How to compute the correlations, options are 'direct', a product with a matrix of lagged
+            signals, 'fft', the full cross-correlation obtained from real FFTs, or 'auto', which chooses
+            the cheaper of the two for the size of the series and number of lags
+
+        Returns
+        -------
+        Series with the correlation at each lag as values, indexed by lag. For several signals,
+        the values for each signal follow each other, indexed by signal number if lag is 0 and by
+        (signal number, lag) otherwise
         """
         from scipy.linalg import norm
 
+        checkParams(method, ['auto', 'direct', 'fft'])
+
         if type(signal) is str:
             s = loadMatVar(signal, var)
+            # MAT files store vectors as two-dimensional arrays
+            if min(s.shape) == 1:
+                s = s.ravel()
         else:
             s = asarray(signal)
 
-        # standardize signal
-        s = s - mean(s)
-        s = s / norm(s)
+        multiple = s.ndim == 2
+        if not multiple:
+            s = s[newaxis, :]
+
+        # standardize signals
+        s = s - mean(s, axis=1)[:, newaxis]
+        s = s / norm(s, axis=1)[:, newaxis]
 
-        if size(s) != size(self.index):
-            raise Exception('Size of signal to cross correlate with, %g, does not match size of series' % size(s))
+        d = s.shape[1]
+        if d != size(self.index):
+            raise Exception('Size of signal to cross correlate with, %g, does not match size of series' % d)
 
-        # created a matrix with lagged signals
+        shifts = range(-lag, lag+1)
+        nsignals = s.shape[0]
         if lag is not 0:
-            shifts = range(-lag, lag+1)
-            d = len(s)
-            m = len(shifts)
-            sShifted = zeros((m, d))
+            index = [(i, shift) for i in range(nsignals) for shift in shifts] if multiple else shifts
+        else:
+            index = range(nsignals) if multiple else 0
+
+        # the fft needs no wrap-around padding beyond the largest lag
+        fftLength = _nextFastLength(d + lag)
+        if method.lower() == 'auto':
+            directCost = nsignals * len(shifts) * d
+            fftCost = 8 * (nsignals + 1) * fftLength * log2(fftLength)
+            method = 'fft' if directCost > fftCost else 'direct'
+
+        if method.lower() == 'fft':
+            sFreq = conj(fft.rfft(s, fftLength, axis=1))
+            kernel = lambda y: _crossCorrFFT(y, sFreq, fftLength, lag)
+        else:
+            # created a matrix with lagged signals
+            sShifted = zeros((nsignals, len(shifts), d))
             for i in range(0, len(shifts)):
-                tmp = roll(s, shifts[i])
+                tmp = roll(s, shifts[i], axis=1)
                 if shifts[i] < 0:  # zero padding
-                    tmp[(d+shifts[i]):] = 0
+                    tmp[:, (d+shifts[i]):] = 0
                 if shifts[i] > 0:
-                    tmp[:shifts[i]] = 0
-                sShifted[i, :] = tmp
-            s = sShifted
-        else:
-            shifts = 0
+                    tmp[:, :shifts[i]] = 0
+                sShifted[:, i, :] = tmp
+            sShifted = sShifted.reshape((nsignals * len(shifts), d))
+            kernel = lambda y: dot(y, sShifted.T)
+
+        def getBatch(y):
+            y = y - mean(y, axis=1)[:, newaxis]
+            n = sqrt((y ** 2).sum(axis=1))
+            # all-zero rows stay zero
+            n[n == 0] = 1
+            y /= n[:, newaxis]
+            out = kernel(y)
+            # a single signal without lags gives one correlation per record
+            return out if multiple or lag is not 0 else out[:, 0]
 
-        def get(y, s):
-            y = y - mean(y)
-            n = norm(y)
-            if n == 0:
-                b = zeros((s.shape[0],))
-            else:
-                y /= norm(y)
-                b = dot(s, y)
-            return b
+        def get(y):
+            return getBatch(y[newaxis, :])[0]
 
-        rdd = self.rdd.mapValues(lambda x: get(x, s))
-        return self._constructor(rdd, index=shifts).__finalize__(self)
+        return self._applyValuesLazily(get, getBatch, index=index)
 
     def detrend(self, method='linear', **kwargs):
         """
-        Detrend time series data with linear or nonlinear detrending
+        Detrend time series data by removing a least-squares fit of a set of basis functions
         Preserve intercept so that subsequent steps can adjust the baseline
 
+        The operator that removes the fit is formed once, from the time index, and broadcast,
+        so that detrending a record (or a whole stacked partition, if vectorized) takes two
+        small matrix products rather than a separate least-squares fit.
+
         Parameters
         ----------
         method : str, optional, default = 'linear'
-            Detrending method
+            Detrending method, options are 'linear', 'nonlin' (polynomial), 'spline' (cubic B-splines),
+            or 'cosine' (discrete cosine high-pass filter). For 'spline' and 'cosine', the mean of each
+            series is preserved in place of the intercept
 
         order : int, optional, default = 5
             Order of polynomial, for non-linear detrending only
+
+        nknots : int, optional, default = 4
+            Number of equally spaced interior knots, for spline detrending only
+
+        cutoff : float, optional, default = half the length of the series
+            Shortest period, in time points, of the cosine components removed, for cosine detrending only
+
+        Other keyword arguments are ignored.
         """
-        checkParams(method, ['linear', 'nonlin'])
+        checkParams(method, ['linear', 'nonlin', 'spline', 'cosine'])
 
-        if method.lower() == 'linear':
-            order = 1
-        else:
-            if 'order' in kwargs:
-                order = kwargs['order']
-            else:
-                order = 5
+        options = dict((k, v) for k, v in kwargs.items() if k in ('order', 'nknots', 'cutoff'))
+        basis = _detrendBasis(method.lower(), len(self.index), **options)
+        bcOperator = self._rdd.context.broadcast(_residualOperator(basis))
 
         def func(y):
-            x = arange(1, len(y)+1)
-            p = polyfit(x, y, order)
-            p[-1] = 0
-            yy = polyval(p, x)
-            return y - yy
+            fit, weights = bcOperator.value
+            return y - dot(fit, dot(y, weights))
 
-        return self.applyValues(func)
+        def batchFunc(y):
+            fit, weights = bcOperator.value
+            return y - dot(dot(y, weights), fit.T)
 
-    def normalize(self, baseline='percentile', window=None, perc=20):
+        return self._applyValuesBatched(func, batchFunc, keepIndex=True)
+
+    def normalize(self, baseline='percentile', window=None, perc=20, decimate=None):
         """
         Normalize each time series by subtracting and dividing by a baseline.
 
@@ -290,37 +634,396 @@ class TimeSeries(Series):
 
         perc : int, optional, default = 20
             Percentile value to use, for 'percentile', 'window', or 'window-fast' baseline only
+
+        decimate : int, optional, default = None
+            If given, the rolling baseline is estimated on the means of consecutive blocks of this many time
+            points, with the window shrunk accordingly, and linearly interpolated back to the full time index.
+            Much faster for long recordings, for 'window' and 'window-fast' baseline only
         """
         checkParams(baseline, ['mean', 'percentile', 'window', 'window-fast'])
         method = baseline.lower()
     
         from warnings import warn
-        if not (method == 'window' or method == 'window-fast') and window is not None:
-            warn('Setting window without using method "window" has no effect')
+        if not (method == 'window' or method == 'window-fast') and (window is not None or decimate is not None):
+            warn('Setting window or decimate without using method "window" has no effect')
+
+        if window is None:
+            window = 6
 
         if method == 'mean':
             baseFunc = mean
+            batchBaseFunc = lambda x: mean(x, axis=1)[:, newaxis]
 
         if method == 'percentile':
             baseFunc = lambda x: percentile(x, perc)
+            batchBaseFunc = lambda x: percentile(x, perc, axis=1)[:, newaxis]
 
         if method == 'window':
-            if window & 0x1:
-                left, right = (ceil(window/2), ceil(window/2) + 1)
-            else:
-                left, right = (window/2, window/2)
-
-            n = len(self.index)
-            baseFunc = lambda x: asarray([percentile(x[max(ix-left, 0):min(ix+right+1, n)], perc)
-                                          for ix in arange(0, n)])
+            def windowFunc(x, size):
+                if size & 0x1:
+                    left, right = (size/2, size/2 + 1)
+                else:
+                    left, right = (size/2, size/2)
+                return _rollingPercentile(x, perc, left, right)
 
         if method == 'window-fast':
             from scipy.ndimage.filters import percentile_filter
-            baseFunc = lambda x: percentile_filter(x.astype(float64), perc, window, mode='nearest')
+
+            def windowFunc(x, size):
+                return percentile_filter(x.astype(float64), perc, size=(1, size), mode='nearest')
+
+        if method == 'window' or method == 'window-fast':
+            if decimate is not None and decimate > 1:
+                batchBaseFunc = lambda x: _decimatedBaseline(x, decimate, windowFunc, window)
+            else:
+                batchBaseFunc = lambda x: windowFunc(x, window)
+            baseFunc = lambda x: batchBaseFunc(x[newaxis, :])[0]
 
         def get(y):
             b = baseFunc(y)
             return (y - b) / (b + 0.1)
 
-        return self.applyValues(get)
+        def getBatch(y):
+            b = batchBaseFunc(y)
+            return (y - b) / (b + 0.1)
+
+        return self._applyValuesBatched(get, getBatch, keepIndex=True)
+
+    def deconvolve(self, method='ar1', g=None, penalty=0, output='spikes'):
+        """
+        Infer non-negative spike trains underlying calcium fluorescence time series
+
+        Each series is modeled as a calcium trace that decays by a factor g at each time point
+        and jumps by the spike amplitude at each spike, plus noise. The trace and spikes minimizing
+        the squared error to the series, plus the penalty times the sum of the spikes, are found
+        exactly with an online pool-adjacent-violators algorithm (OASIS), in a single sweep over
+        each series. Series are assumed to have a baseline of zero, e.g. after normalize().
+
+        Parameters
+        ----------
+        method : str, optional, default = 'ar1'
+            Model of the calcium dynamics, only first-order autoregressive ('ar1') is supported
+
+        g : float, optional, default = None
+            Decay factor of the calcium trace per time point, between 0 and 1. If None, it is
+            estimated for each series from the ratio of its autocovariances at lags 2 and 1,
+            which is unaffected by white noise
+
+        penalty : float, optional, default = 0
+            Sparsity penalty on the total spike amplitude
+
+        output : str, optional, default = 'spikes'
+            Whether to return the inferred 'spikes' or the denoised 'calcium' trace
+        """
+        checkParams(method, ['ar1'])
+        checkParams(output, ['spikes', 'calcium'])
+        returnSpikes = output.lower() == 'spikes'
+
+        def getBatch(y):
+            y = asarray(y, dtype=float64)
+            decays = _estimateDecay(y) if g is None else full(y.shape[0], g)
+            out = empty(y.shape)
+            for i in xrange(y.shape[0]):
+                c = _oasisAR1(y[i].tolist(), decays[i], penalty)
+                out[i] = c
+                if returnSpikes:
+                    # the spikes are non-negative by construction, up to rounding
+                    out[i, 1:] = maximum(c[1:] - decays[i] * c[:-1], 0)
+            return out
+
+        def get(y):
+            return getBatch(y[newaxis, :])[0]
+
+        return self._applyValuesBatched(get, getBatch, keepIndex=True)
 
+
+def _convolveDirect(y, s):
+    """
+    Full convolutions of each row of `y` with each row of `s`, as an array of shape
+    (nrows, nsignals, n + m - 1), computed as sums of shifted copies of `y`.
+    """
+    nrows, n = y.shape
+    nsignals, m = s.shape
+    out = zeros((nrows, nsignals, n + m - 1))
+    for i in xrange(nsignals):
+        for j in xrange(m):
+            out[:, i, j:j+n] += s[i, j] * y
+    return out
+
+
+def _convolveOverlapAdd(y, sFreq, m, blockLength):
+    """
+    Full convolutions of each row of `y` with each of a set of signals of length `m`, given their real FFTs,
+    as an array of shape (nrows, nsignals, n + m - 1).
+
+    The rows are split into blocks of `blockLength` points, which must be at least m - 1, and all blocks of
+    all rows are transformed at once. Each convolved block then overlaps only the next one.
+    """
+    nrows, n = y.shape
+    nsignals, nfreqs = sFreq.shape
+    nblocks = -(-n / blockLength)
+    fftLength = blockLength + m - 1
+    blocks = zeros((nrows, nblocks * blockLength))
+    blocks[:, :n] = y
+    blocks = blocks.reshape((nrows, 1, nblocks, blockLength))
+    conv = fft.irfft(fft.rfft(blocks, fftLength, axis=3) * sFreq[newaxis, :, newaxis, :], fftLength, axis=3)
+
+    out = zeros((nrows, nsignals, (nblocks + 1) * blockLength))
+    out[:, :, :nblocks * blockLength] = conv[:, :, :, :blockLength].reshape((nrows, nsignals, -1))
+    tails = zeros((nrows, nsignals, nblocks, blockLength))
+    tails[:, :, :, :m - 1] = conv[:, :, :, blockLength:]
+    out[:, :, blockLength:] += tails.reshape((nrows, nsignals, -1))
+    return out[:, :, :n + m - 1]
+
+
+def _welchSegments(y, nperseg, step, window):
+    """
+    Real FFTs of overlapping, demeaned and windowed segments of each row of `y`, as an array of shape
+    (nrows, nsegments, nperseg/2 + 1). Segments are taken as a strided view of `y`, without copying.
+    """
+    from numpy.lib.stride_tricks import as_strided
+
+    y = asarray(y, dtype=float64)
+    nrows, n = y.shape
+    nsegs = (n - nperseg) / step + 1
+    segs = as_strided(y, shape=(nrows, nsegs, nperseg), strides=(y.strides[0], step * y.strides[1], y.strides[1]))
+    segs = (segs - segs.mean(axis=2)[:, :, newaxis]) * window
+    return fft.rfft(segs, axis=2)
+
+
+def _nextFastLength(n):
+    """
+    Smallest length of at least `n` with no prime factors other than 2, 3 and 5, for which FFTs are fast.
+    """
+    best = 2 ** int(ceil(log2(max(n, 1))))
+    p5 = 1
+    while p5 < best:
+        p35 = p5
+        while p35 < best:
+            # smallest power of two bringing p35 up to n
+            length = p35
+            while length < n:
+                length *= 2
+            best = min(best, length)
+            p35 *= 3
+        p5 *= 5
+    return best
+
+
+def _crossCorrFFT(y, sFreq, fftLength, lag):
+    """
+    Cross-correlations of each row of `y` with each of a set of signals at lags from -lag to lag, given the
+    conjugated real FFTs of the signals, of length `fftLength`. Returns an array of shape
+    (nrows, nsignals * (2*lag + 1)), holding the lags of each signal in turn.
+    """
+    yFreq = fft.rfft(y, fftLength, axis=1)
+    full = fft.irfft(yFreq[:, newaxis, :] * sFreq[newaxis, :, :], fftLength, axis=2)
+    # negative lags wrap around to the end
+    lags = arange(-lag, lag+1) % fftLength
+    return full[:, :, lags].reshape((y.shape[0], -1))
+
+
+def _fourierStats(y, freqs, basis=None):
+    """
+    Coherence and phase of each row of a two-dimensional array at the given frequencies, as two arrays of
+    shape (nrows, len(freqs)).
+
+    If `basis` is given, it holds the complex exponentials for the requested frequencies as columns, and the
+    Fourier coefficients are computed by a matrix product, with the total power over the lower half of the
+    spectrum obtained from the time domain by Parseval's theorem. Otherwise a real FFT is used.
+    """
+    y = y - mean(y, axis=1)[:, newaxis]
+    nframes = y.shape[1]
+    if basis is None:
+        ft = fft.rfft(y, axis=1)[:, 0:int(fix(nframes/2))]
+        power = (abs(ft)**2).sum(axis=1)
+        ft = ft[:, freqs]
+    else:
+        ft = dot(y, basis)
+        # the spectrum of a real series is symmetric, so the lower half holds half the total power, less
+        # that of frequency nframes/2 (rounded down), which is excluded from it, as is its mirror image if distinct
+        last = abs(dot(y, exp(-2j * pi * (nframes/2) * arange(nframes) / nframes))) ** 2
+        nlast = 1 if nframes % 2 == 0 else 2
+        power = (nframes * (y**2).sum(axis=1) - nlast * last) / 2
+    co = abs(ft) / sqrt(power)[:, newaxis]
+    ph = -(pi/2) - angle(ft)
+    ph[ph < 0] += pi * 2
+    return co, ph
+
+
+def _detrendBasis(method, n, order=5, nknots=4, cutoff=None):
+    """
+    Returns a design matrix of shape (n, k) with the basis functions of the given detrending method evaluated
+    at time points 1 to n, its last column being the constant term to be preserved.
+    """
+    x = arange(1, n+1, dtype=float64)
+    if method == 'linear':
+        return vander(x, 2)
+    if method == 'nonlin':
+        return vander(x, order+1)
+    if method == 'spline':
+        from scipy.interpolate import BSpline
+        knots = concatenate(([x[0]] * 3, linspace(x[0], x[-1], nknots + 2), [x[-1]] * 3))
+        splines = BSpline(knots, identity(nknots + 4), 3)(x)
+        return column_stack((splines - splines.mean(axis=0), ones(n)))
+    if method == 'cosine':
+        if cutoff is None:
+            cutoff = n / 2.0
+        ncos = max(int(2 * n / float(cutoff)), 1)
+        cosines = cos(pi * outer(x - 0.5, arange(1, ncos + 1)) / n)
+        return column_stack((cosines, ones(n)))
+
+
+def _residualOperator(basis):
+    """
+    Factors the removal of the least-squares fit of all but the last column of `basis` from a series into
+    a pair of arrays (fit, weights) of shape (n, k-1), such that the fitted trend of y is dot(fit, dot(y, weights)).
+    """
+    from numpy.linalg import norm, pinv
+    # scale the columns to unit norm, which leaves the fit unchanged but keeps high orders well conditioned
+    basis = basis / norm(basis, axis=0)
+    return basis[:, :-1], pinv(basis)[:-1].T
+
+
+def _estimateDecay(y):
+    """
+    Estimates the decay factor of an AR(1) process underlying each row of `y`, observed with white noise,
+    as the ratio of the autocovariances at lags 2 and 1, clipped to [0, 1).
+    """
+    y = y - mean(y, axis=1)[:, newaxis]
+    acov1 = (y[:, 1:] * y[:, :-1]).sum(axis=1)
+    acov2 = (y[:, 2:] * y[:, :-2]).sum(axis=1)
+    ratio = acov2 / where(acov1 > 0, acov1, 1)
+    return clip(where(acov1 > 0, ratio, 0), 0, 0.999)
+
+
+def _oasisAR1(y, g, penalty=0):
+    """
+    Non-negative deconvolution of a series, given as a list, under a first-order autoregressive model with
+    decay factor `g`, by the pool-adjacent-violators algorithm of Friedrich, Zhou & Paninski (2017).
+
+    Returns the denoised calcium trace c, minimizing 1/2 ||c - y||^2 + penalty * sum(s) subject to
+    s = c[t] - g * c[t-1] >= 0 and c[0] >= 0.
+    """
+    n = len(y)
+    if n == 0:
+        return zeros(0)
+    # the penalty is linear in c, so can be absorbed into the data
+    shift = penalty * (1 - g)
+    last = n - 1
+    # pools of time points sharing one spike, as (value at start, weight, start, length)
+    pools = []
+    for t in xrange(n):
+        v = y[t] - (penalty if t == last else shift)
+        w = 1.0
+        start = t
+        length = 1
+        # merge backwards while the previous pool decays to above the start of this one, i.e. a negative spike
+        while pools:
+            pv, pw, pt, pl = pools[-1]
+            decay = g ** pl
+            if pv * decay <= v:
+                break
+            pools.pop()
+            w2 = w * decay * decay
+            v = (pw * pv + w * decay * v) / (pw + w2)
+            w = pw + w2
+            start = pt
+            length += pl
+        pools.append((v, w, start, length))
+
+    values, _, starts, lengths = [asarray(p) for p in zip(*pools)]
+    poolOf = repeat(arange(len(pools)), lengths)
+    return maximum(values, 0)[poolOf] * g ** (arange(n) - starts[poolOf])
+
+
+def _rollingPercentile(x, perc, left, right):
+    """
+    Percentile of each row of a two-dimensional array within a window running from `left` points before
+    to `right` points after each time point, truncated at the ends of the rows.
+
+    No window is sorted from scratch; instead a sorted copy of the current window is updated at each step
+    by deleting the point leaving the window and inserting the point entering it. For small windows over
+    many rows, the windows of all rows are updated together with one vectorized gather per time point,
+    otherwise each row is processed in turn with a sorted list.
+    """
+    x = asarray(x, dtype=float64)
+    nrows, n = x.shape
+    size = left + right + 1
+    if nrows < 16 or size > 64 or size > n:
+        out = empty((nrows, n))
+        for i in xrange(nrows):
+            out[i] = _rollingPercentileRow(x[i].tolist(), perc, left, right)
+        return out
+
+    out = empty((nrows, n))
+    # windows truncated by the ends of the rows are few, compute them directly
+    edges = [ix for ix in xrange(n) if ix < left or ix + right >= n]
+    for ix in edges:
+        out[:, ix] = percentile(x[:, max(ix-left, 0):min(ix+right+1, n)], perc, axis=1)
+
+    pos = perc / 100.0 * (size - 1)
+    lo = int(floor(pos))
+    hi = min(lo + 1, size - 1)
+    frac = pos - lo
+
+    cols = arange(size)[newaxis, :]
+    offsets = (arange(nrows) * size)[:, newaxis]
+    window = sort(x[:, :size], axis=1)
+    for ix in xrange(left, n - right):
+        out[:, ix] = window[:, lo] + (window[:, hi] - window[:, lo]) * frac
+        if ix + right + 1 == n:
+            break
+        leaving = x[:, ix - left][:, newaxis]
+        entering = x[:, ix + right + 1][:, newaxis]
+        # position of the leaving point, and of the entering point once the leaving one has been removed
+        removeAt = (window < leaving).sum(axis=1)[:, newaxis]
+        insertAt = (window < entering).sum(axis=1)[:, newaxis] - (leaving < entering)
+        src = cols - (cols > insertAt)
+        src += (src >= removeAt)
+        minimum(src, size - 1, out=src)
+        window = take(window, src + offsets)
+        window[cols == insertAt] = entering[:, 0]
+    return out
+
+
+def _rollingPercentileRow(row, perc, left, right):
+    """
+    Rolling percentile of a single row, given as a list, with the same windows as _rollingPercentile.
+    """
+    from bisect import insort, bisect_left
+
+    n = len(row)
+    q = perc / 100.0
+    out = [0.0] * n
+    window = sorted(row[:right])
+    for ix in xrange(n):
+        if ix + right < n:
+            insort(window, row[ix + right])
+        if ix > left:
+            del window[bisect_left(window, row[ix - left - 1])]
+        pos = q * (len(window) - 1)
+        lo = int(pos)
+        out[ix] = window[lo] + (window[lo + 1] - window[lo]) * (pos - lo) if pos > lo else window[lo]
+    return out
+
+
+def _decimatedBaseline(x, factor, windowFunc, window):
+    """
+    Estimates a rolling baseline on the means of consecutive blocks of `factor` time points of each row,
+    using `windowFunc(blocks, size)` with the window size scaled down by `factor`, and linearly
+    interpolates the result back to every time point.
+    """
+    x = asarray(x, dtype=float64)
+    n = x.shape[1]
+    starts = arange(0, n, factor)
+    stops = minimum(starts + factor, n)
+    blocks = add.reduceat(x, starts, axis=1) / (stops - starts)
+    base = windowFunc(blocks, max(int(round(window / float(factor))), 1))
+
+    # fractional block position of each time point, relative to block centers
+    pos = interp(arange(n), (starts + stops - 1) / 2.0, arange(len(starts)))
+    lo = floor(pos).astype(int)
+    hi = minimum(lo + 1, len(starts) - 1)
+    frac = pos - lo
+    return base[:, lo] * (1 - frac) + base[:, hi] * frac
@@ -24,6 +24,40 @@ def isRdd(data):
         return False
 
 
+def treeAggregate(rdd, zeroValue, seqOp, combOp, depth=2):
+    """
+    Aggregate the elements of an RDD in a tree of the given depth, or with a plain aggregate
+    on Spark releases without RDD.treeAggregate
+    """
+    if hasattr(rdd, 'treeAggregate'):
+        return rdd.treeAggregate(zeroValue, seqOp, combOp, depth=depth)
+    return rdd.aggregate(zeroValue, seqOp, combOp)
+
+
+def treeReduce(rdd, f, depth=2):
+    """
+    Reduce the elements of an RDD in a tree of the given depth, or with a plain reduce
+    on Spark releases without RDD.treeReduce
+    """
+    if hasattr(rdd, 'treeReduce'):
+        return rdd.treeReduce(f, depth=depth)
+    return rdd.reduce(f)
+
+
+def toLocalIterator(rdd):
+    """
+    Iterate over the elements of an RDD on the driver, holding one partition at a time where possible,
+    on Spark releases without RDD.toLocalIterator
+    """
+    if hasattr(rdd, 'toLocalIterator'):
+        return rdd.toLocalIterator()
+    if hasattr(rdd.context, 'runJob'):
+        from itertools import chain
+        return chain.from_iterable(rdd.context.runJob(rdd, lambda it: it, [i])
+                                   for i in xrange(rdd.getNumPartitions()))
+    return iter(rdd.collect())
+
+
 def checkParams(param, opts):
     """ Check whether param is contained in opts (including lowercase), otherwise error """
     if not param.lower() in opts:
@@ -0,0 +1,131 @@
+from numpy import arange, asarray, concatenate, cumsum, empty, full, maximum, minimum, random, sort
+
+
+class QuantileSketch(object):
+    """
+    Mergeable sketch of the distribution of array values, giving approximate quantiles for
+    each element with bounded memory.
+
+    Values are kept in a hierarchy of compactors, where each value at level h stands for 2**h
+    original values. Whenever a level holds more than k values, the values for each element are
+    sorted and every other one, starting at random from the first or second, is promoted to the
+    next level, halving the level's size. Each compaction shifts the rank of any value by at most
+    the weight of the level, so that the rank error of a quantile is about log2(n / k) / k of n,
+    while memory is bounded by about k * log2(n / k) values per element.
+
+    Sketches built on different subsets of values can be merged, in any order, into a sketch of
+    all values, as with StatCounter.
+
+    Parameters
+    ----------
+    values : iterable of arrays, optional, default = ()
+        Initial values, all of the same shape
+
+    k : int, optional, default = 256
+        Maximum number of values per level, trading accuracy for memory
+
+    seed : int, optional, default = None
+        Seed of the random choices made during compaction
+    """
+    def __init__(self, values=(), k=256, seed=None):
+        self.k = k
+        self.n = 0
+        self.levels = []
+        self.minValue = None
+        self.maxValue = None
+        self._random = random.RandomState(seed)
+
+        for v in values:
+            self.merge(v)
+
+    def merge(self, value):
+        """ Add a single value into this sketch """
+        value = asarray(value)
+        return self.mergeBatch(value.reshape((1,) + value.shape))
+
+    def mergeBatch(self, values):
+        """ Add a batch of values, stacked along the first axis of an array, into this sketch """
+        values = asarray(values)
+        if values.shape[0] == 0:
+            return self
+        self._addToLevel(0, values)
+        self._updateCounts(values.shape[0], values.min(axis=0), values.max(axis=0))
+        return self._compact()
+
+    def mergeSketch(self, other):
+        """ Merge another QuantileSketch into this one """
+        if not isinstance(other, QuantileSketch):
+            raise Exception("Can only merge QuantileSketches!")
+        if other.n == 0:
+            return self
+        for h, level in enumerate(other.levels):
+            self._addToLevel(h, level)
+        self._updateCounts(other.n, other.minValue, other.maxValue)
+        return self._compact()
+
+    def count(self):
+        return self.n
+
+    def quantiles(self, qs):
+        """
+        Approximate quantiles of the values for each element.
+
+        Parameters
+        ----------
+        qs : float or sequence of floats
+            Quantiles to return, between 0 and 1. Quantiles 0 and 1 are the exact minimum and maximum
+
+        Returns
+        -------
+        Array of the shape of the values for a single quantile, otherwise with an additional first
+        axis along the requested quantiles
+        """
+        if self.n == 0:
+            raise ValueError("Cannot compute quantiles of an empty sketch")
+        single = not hasattr(qs, '__iter__')
+        qs = asarray([qs] if single else qs, dtype='float64')
+
+        shape = self.minValue.shape if hasattr(self.minValue, 'shape') else ()
+        values = concatenate([level.reshape((level.shape[0], -1)) for level in self.levels if level.shape[0]])
+        weights = concatenate([full(level.shape[0], 2 ** h) for h, level in enumerate(self.levels)])
+        order = values.argsort(axis=0, kind='mergesort')
+        cols = arange(values.shape[1])
+        values = values[order, cols]
+        cumWeights = cumsum(weights[order], axis=0)
+
+        out = empty((len(qs), values.shape[1]))
+        for i, q in enumerate(qs):
+            # the first value whose cumulative weight reaches the requested rank
+            ranks = minimum((cumWeights < q * self.n).sum(axis=0), values.shape[0] - 1)
+            out[i] = values[ranks, cols]
+        out = out.reshape((len(qs),) + shape)
+        out[qs <= 0] = self.minValue
+        out[qs >= 1] = self.maxValue
+        return out[0] if single else out
+
+    def copy(self):
+        import copy
+        return copy.deepcopy(self)
+
+    def _addToLevel(self, h, values):
+        while len(self.levels) <= h:
+            self.levels.append(values[:0])
+        self.levels[h] = concatenate((self.levels[h], values)) if self.levels[h].shape[0] else values
+
+    def _updateCounts(self, n, minValue, maxValue):
+        self.n += n
+        self.minValue = minValue if self.minValue is None else minimum(self.minValue, minValue)
+        self.maxValue = maxValue if self.maxValue is None else maximum(self.maxValue, maxValue)
+
+    def _compact(self):
+        h = 0
+        while h < len(self.levels):
+            level = self.levels[h]
+            if level.shape[0] > self.k:
+                level = sort(level, axis=0)
+                npairs = level.shape[0] / 2
+                # any value left without a pair stays at this level
+                self.levels[h] = level[2*npairs:]
+                self._addToLevel(h + 1, level[self._random.randint(2):2*npairs:2])
+            h += 1
+        return self
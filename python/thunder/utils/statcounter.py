@@ -74,6 +74,29 @@ class StatCounter(object):
 
         return self
 
+    # Merge a batch of values, stacked along the first axis of an array, into this StatCounter.
+    # Count, mean, m2, max and min of the batch are computed with one numpy call each and then
+    # combined with the running statistics using the same parallel formula as mergeStats.
+    def mergeBatch(self, values):
+        from numpy import asarray
+        values = asarray(values)
+        if values.shape[0] == 0:
+            return self
+
+        batch = StatCounter(stats=())
+        batch.requiredAttrs = self.requiredAttrs
+        batch.n = values.shape[0]
+        if self.__requires('mu'):
+            batch.mu = values.mean(axis=0)
+            if self.__requires('m2'):
+                batch.m2 = ((values - batch.mu) ** 2).sum(axis=0)
+        if self.__requires('maxValue'):
+            batch.maxValue = values.max(axis=0)
+        if self.__requires('minValue'):
+            batch.minValue = values.min(axis=0)
+
+        return self.mergeStats(batch)
+
     # checks whether the passed attribute name is required to be updated in order to support the
     # statistics requested in self.requestedStats.
     def __requires(self, attrName):